@@ -1,12 +1,12 @@
 import matplotlib.pyplot as plt
 from w_helpers import load_data, aggregate_by_day, extract_day_of_hourly, label_date
+from w_helpers import DecimatedLine, get_router
 
 import uuid
 
 datasource = 'mdw'
 
-temperature = load_data(datasource)
-temperature = temperature[temperature['year'] >= 2017]
+temperature = load_data(datasource, start='2017')
 temperature_daily = aggregate_by_day(temperature)
 
 
@@ -18,25 +18,23 @@ class RowPrinter:
         ln.set_gid(self.uid)
         self.ln = ln
         self.df = df
+        self.router = get_router(ln.figure.canvas)
         self.cid = None
         self.connect()
 
     def connect(self):
         self.remove()
-        self.cid = ln.figure.canvas.mpl_connect('pick_event',
-                                                self)
+        # only picks on artists with our gid get to us
+        self.cid = self.router.connect('pick_event', self, gid=self.uid)
 
     def __call__(self, event):
-        # ignore picks on not-our-artist
-        if event.artist is not self.ln:
-            return
         # for each hit index, print out the row
         for i in event.ind:
             print(self.df.iloc[i])
 
     def remove(self):
         if self.cid is not None:
-            self.ln.figure.canvas.mpl_disconnect(self.cid)
+            self.router.disconnect(self.cid)
             self.cid = None
 
 
@@ -47,6 +45,8 @@ ax.set_ylabel('Air Temperature [℃]')
 ax.set_title(f'{datasource} temperature')
 
 rp = RowPrinter(ln, temperature_daily)
+# only draw what can be seen, picks still map to rows of temperature_daily
+dl = DecimatedLine(ln)
 
 one_day = extract_day_of_hourly(temperature, 2017, 10, 27)
 plt.show()
@@ -60,4 +60,5 @@ plt.show()
 # - make picking add a label using the function `label_date` (which is
 #   already imported from the `w_helpers` module)
 
-# - use `get_gid` to filter artists instead of `is not`
+# - use `get_gid` to filter artists instead of `is not` in a handler
+#   connected directly with `ln.figure.canvas.mpl_connect`
@@ -1,7 +1,10 @@
+import time
+
 import matplotlib.pyplot as plt
-from cycler import cycler
-from w_helpers import (load_data, aggregate_by_month, aggregate_by_day,
-                       extract_day_of_hourly, extract_month_of_daily)
+from cycler import cycler, Cycler
+from w_helpers import (load_data, load_aggregates, aggregate, aggregate_many,
+                       day_offsets, extract_day_of_hourly,
+                       extract_month_of_daily, SliceCache, get_router)
 
 
 def setup_temperature_figure(**kwargs):
@@ -18,7 +21,8 @@ def setup_temperature_figure(**kwargs):
     return fig, ax_lst
 
 
-def plot_aggregated_errorbar(ax, gb, label, picker=None, **kwargs):
+def plot_aggregated_errorbar(ax, gb, label, picker=None, *, redraw=True,
+                             **kwargs):
     kwargs.setdefault('capsize', 3)
     kwargs.setdefault('markersize', 5)
     eb = ax.errorbar(gb.index, 'mean',
@@ -29,14 +33,109 @@ def plot_aggregated_errorbar(ax, gb, label, picker=None, **kwargs):
                      **kwargs)
     fill = ax.fill_between(gb.index, 'min', 'max', alpha=.5,
                            data=gb, color=eb[0].get_color())
-    ax.legend()
-    ax.figure.canvas.draw_idle()
+    if redraw:
+        ax.legend()
+        ax.figure.canvas.draw_idle()
     return eb, fill
 
 
+class BlitManager:
+    def __init__(self, canvas):
+        '''Redraw only the artists that change
+
+        Artists passed to `add_artist` are marked as animated so a full
+        draw of the figure skips them.  After every full draw the
+        background of each axes we manage is cached, `update` restores
+        it and draws just the animated artists of one axes on top.
+
+        If the view limits of any managed axes have changed (for example
+        from autoscaling to new data) the cached backgrounds are stale and
+        `update` falls back to a full draw.
+
+        Parameters
+        ----------
+        canvas : FigureCanvas
+            The canvas to manage
+        '''
+        self.canvas = canvas
+        # axes -> list of animated artists
+        self.artists = {}
+        # axes -> (background, view limits)
+        self._backgrounds = {}
+        # axes -> labels in the current legend
+        self._legend_labels = {}
+        # seconds taken by the last call to `update`
+        self.last_update = None
+        self.cid = canvas.mpl_connect('draw_event', self._on_draw)
+
+    def add_artist(self, ax, art):
+        art.set_animated(True)
+        self.artists.setdefault(ax, []).append(art)
+
+    def remove_artist(self, ax, art):
+        if art in self.artists.get(ax, []):
+            self.artists[ax].remove(art)
+
+    def update_legend(self, ax):
+        '''Re-build the legend of ``ax`` only if its entries have changed
+        '''
+        handles, labels = ax.get_legend_handles_labels()
+        if self._legend_labels.get(ax) == labels:
+            return
+        self._legend_labels[ax] = labels
+        if ax.get_legend() is not None:
+            self.remove_artist(ax, ax.get_legend())
+        if labels:
+            self.add_artist(ax, ax.legend(handles, labels))
+        elif ax.get_legend() is not None:
+            ax.get_legend().remove()
+
+    def _on_draw(self, event):
+        # savefig draws at its own dpi (possibly with another renderer),
+        # those pixels are no use as a background for the screen
+        if event.canvas.is_saving():
+            return
+        get_renderer = getattr(self.canvas, 'get_renderer', None)
+        if get_renderer is not None and event.renderer is not get_renderer():
+            return
+        for ax in self.artists:
+            self._backgrounds[ax] = (self.canvas.copy_from_bbox(ax.bbox),
+                                     ax.viewLim.bounds)
+            self._draw_animated(ax)
+
+    def _draw_animated(self, ax):
+        for art in self.artists[ax]:
+            ax.draw_artist(art)
+
+    def update(self, ax):
+        '''Redraw the animated artists of ``ax``
+        '''
+        start = time.perf_counter()
+        # asking for viewLim applies any pending autoscaling
+        if (ax not in self._backgrounds or
+                any(a.viewLim.bounds != lims
+                    for a, (bg, lims) in self._backgrounds.items())):
+            self.canvas.draw_idle()
+        else:
+            self.canvas.restore_region(self._backgrounds[ax][0])
+            self._draw_animated(ax)
+            self.canvas.blit(ax.bbox)
+            self.canvas.flush_events()
+        self.last_update = time.perf_counter() - start
+
+    def remove(self):
+        self.canvas.mpl_disconnect(self.cid)
+        for arts in self.artists.values():
+            for art in arts:
+                art.set_animated(False)
+        self.artists = {}
+        self._backgrounds = {}
+
+
 class AggregatedTimeTrace:
     def __init__(self, hourly_data, label, yearly_ax, monthly_ax, daily_ax,
-                 agg_by_day=None, agg_by_month=None, style_cycle=None):
+                 agg_by_day=None, agg_by_month=None, style_cycle=None,
+                 slice_cache=None, blit=False, router=None):
         '''Class to manage 3-levels of aggregated temperature
 
         Parameters
@@ -59,25 +158,39 @@ class AggregatedTimeTrace:
         agg_by_day : DataFrame, optional
 
             Data already aggregated by day.  This is just to save
-            computation, will be computed if not provided.
+            computation, will be computed if not provided (see
+            `from_dataset` to use the stored aggregates).
 
         agg_by_month : DataFrame, optional
 
             Data already aggregated by month.  This is just to save
-            computation, will be computed if not provided.
+            computation, will be computed if not provided (see
+            `from_dataset` to use the stored aggregates).
 
-        style_cycle : Cycler, optional
-            Style to use for plotting
+        style_cycle : Cycler or iterator, optional
+            Style to use for plotting.  Pass an iterator (the result of
+            calling a Cycler) to share it between instances.
+
+        slice_cache : SliceCache, optional
+            Where to keep the months and days we have extracted.  May be
+            shared between instances with different labels.
+
+        blit : bool or BlitManager, optional
+            If True, only redraw the month / day axes artists that change
+            on each pick rather than the whole figure.  Pass a
+            `BlitManager` to share one between instances.
+
+        router : EventRouter, optional
+            Where to register for pick events, defaults to the one shared
+            by everything on the canvas (see `get_router`)
 
         '''
+        # name
+        self.label = label
         # data
-        self.data_by_hour = hourly_data
-        if agg_by_day is None:
-            agg_by_day = aggregate_by_day(hourly_data)
-        self.data_by_day = agg_by_day
-        if agg_by_month is None:
-            agg_by_month = aggregate_by_month(hourly_data)
-        self.data_by_month = agg_by_month
+        if slice_cache is None:
+            slice_cache = SliceCache()
+        self.slice_cache = slice_cache
         # style
         if style_cycle is None:
             style_cycle = ((cycler('marker', ['o', 's', '^', '*',
@@ -87,38 +200,104 @@ class AggregatedTimeTrace:
                                    ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728',
                                     '#9467bd', '#8c564b', '#e377c2', '#7f7f7f',
                                     '#bcbd22', '#17becf'])))
-        self.style_cycle = style_cycle()
+        if isinstance(style_cycle, Cycler):
+            style_cycle = style_cycle()
+        self.style_cycle = style_cycle
         # axes
         self.yearly_ax = yearly_ax
         self.monthly_ax = monthly_ax
         self.daily_ax = daily_ax
-        # name
-        self.label = label
+        # rendering
+        canvas = self.yearly_ax.figure.canvas
+        if blit is True and getattr(canvas, 'supports_blit', True):
+            blit = BlitManager(canvas)
+        self.blit_manager = blit or None
         # these will be used for book keeping
         self.daily_artists = {}
         self.daily_index = {}
-        self.hourly_artiists = {}
+        self.hourly_artists = {}
+        if router is None:
+            router = get_router(self.yearly_ax.figure.canvas)
+        self.router = router
+        # gid -> router connection
+        self._connections = {}
         # artists
+        self.yearly_art = None
+        self._yearly_style = next(self.style_cycle)
+        self.set_data(hourly_data, agg_by_day, agg_by_month)
+
+    @classmethod
+    def from_dataset(cls, dataset, yearly_ax, monthly_ax, daily_ax,
+                     label=None, **kwargs):
+        '''Show a dataset using its pre-computed aggregates
+
+        Parameters
+        ----------
+        dataset : str
+            Loaded with `load_data`, the aggregates with `load_aggregates`
+
+        yearly_ax, monthly_ax, daily_ax : Axes
+            See `__init__`
+
+        label : str, optional
+            Defaults to `dataset`
+
+        **kwargs
+            Passed on to `__init__`
+        '''
+        agg = load_aggregates(dataset)
+        return cls(load_data(dataset),
+                   dataset if label is None else label,
+                   yearly_ax, monthly_ax, daily_ax,
+                   agg_by_day=agg['day'], agg_by_month=agg['month'],
+                   **kwargs)
+
+    def set_data(self, hourly_data, agg_by_day=None, agg_by_month=None):
+        '''Replace the data shown
+
+        The yearly trace is re-plotted and the months / days picked from
+        the old data (and any cached slices of it) are dropped.  See
+        `__init__` for the parameters.
+        '''
+        self.data_by_hour = hourly_data
+        self.day_offsets = day_offsets(hourly_data)
+        if agg_by_day is None or agg_by_month is None:
+            agg = aggregate(hourly_data)
+            if agg_by_day is None:
+                agg_by_day = agg['day']
+            if agg_by_month is None:
+                agg_by_month = agg['month']
+        self.data_by_day = agg_by_day
+        self.data_by_month = agg_by_month
+        self.slice_cache.invalidate(self.label)
+
+        if self.yearly_art is not None:
+            # picks on the old artists would index the new data
+            self._clear_picks()
+            self._remove_yearly()
+            for ax in (self.monthly_ax, self.daily_ax):
+                self._refresh(ax)
         self.yearly_art = plot_aggregated_errorbar(self.yearly_ax,
                                                    self.data_by_month,
                                                    self.label,
                                                    picker=5,
-                                                   **next(self.style_cycle))
+                                                   **self._yearly_style)
+        self.yearly_art[0][0].set_gid(self.label)
+
+        # pick methods, the router only calls the one for the artist
+        self._connect(self.yearly_ax, self.label, self._yearly_on_pick)
+
+    def _connect(self, ax, gid, handler):
+        self._connections[gid] = self.router.connect('pick_event', handler,
+                                                     ax=ax, gid=gid)
 
-        # pick methods
-        self.y_cid = self.yearly_ax.figure.canvas.mpl_connect(
-            'pick_event', self._yearly_on_pick)
-        self.y_cid = self.yearly_ax.figure.canvas.mpl_connect(
-            'pick_event', self._monthly_on_pick)
-        self.y_cid = self.yearly_ax.figure.canvas.mpl_connect(
-            'pick_event', self._daily_on_pick)
+    def _disconnect(self, gid):
+        if gid in self._connections:
+            self.router.disconnect(self._connections.pop(gid))
 
     def _yearly_on_pick(self, event):
         '''Process picks on 'year' scale axes
         '''
-        # if not the right axes, bail
-        if event.mouseevent.inaxes is not self.yearly_ax:
-            return
         # make sure the artists we expect exists and we picked it
         if self.yearly_art is None or event.artist is not self.yearly_art[0][0]:
             return
@@ -129,7 +308,9 @@ class AggregatedTimeTrace:
 
     def _plot_T_by_day(self, year, month):
         # get the data we need
-        df = extract_month_of_daily(self.data_by_day, year, month)
+        df = self.slice_cache.get(
+            (self.label, year, month),
+            lambda: extract_month_of_daily(self.data_by_day, year, month))
         # format the label
         label = '{:s}: {:04d}-{:02d}'.format(self.label, year, month)
         # if we have already plotted this, don't bother
@@ -137,36 +318,29 @@ class AggregatedTimeTrace:
             return
         # plot the data
         eb, fill = plot_aggregated_errorbar(self.monthly_ax, df, label,
-                                            picker=5, **next(self.style_cycle))
+                                            picker=5, redraw=False,
+                                            **next(self.style_cycle))
         # set the gid of the line (which is what will be picked) to label
         eb[0].set_gid(label)
+        self._connect(self.monthly_ax, label, self._monthly_on_pick)
         # stash the artists so we can remove them later
         self.daily_artists[label] = [eb, fill]
         # stash the dates associated with the points so we can use in
         # plotting later
         self.daily_index[label] = df['index']
+        self._track(self.monthly_ax, eb.get_children() + [fill])
+        self._refresh(self.monthly_ax)
 
     def _monthly_on_pick(self, event):
         '''Process picks on 'month' scale axes
         '''
-        # if we are not in the right axes, bail
-        if event.mouseevent.inaxes is not self.monthly_ax:
-            return
         # get the label from the picked aritst
         label = event.artist.get_gid()
         # if the shift key is held down, remove this data
         if event.mouseevent.key == 'shift':
-            self.daily_index.pop(label, None)
-            arts = self.daily_artists.pop(label, [])
-            for art in arts:
-                # work around a bug!
-                if art in self.monthly_ax.containers:
-                    self.monthly_ax.containers.remove(art)
-                art.remove()
-            # regenerate the legend
-            self.monthly_ax.legend()
-            # ask the GUI to redraw when convenient
-            self.monthly_ax.figure.canvas.draw_idle()
+            self._remove_month(label)
+            # regenerate the legend and redraw
+            self._refresh(self.monthly_ax)
             return
         # else, loop through the points we hit and plot the daily
         for i in event.ind:
@@ -175,44 +349,216 @@ class AggregatedTimeTrace:
 
     def _plot_T_by_hour(self, year, month, day):
         # get the hourly data for a single day
-        df = extract_day_of_hourly(self.data_by_hour, year, month, day)
+        df = self.slice_cache.get(
+            (self.label, year, month, day),
+            lambda: extract_day_of_hourly(self.data_by_hour, year, month, day,
+                                          offsets=self.day_offsets))
         # format the label
         label = '{:s}: {:04d}-{:02d}-{:02d}'.format(
             self.label, year, month, day)
+        # if we have already plotted this, don't bother
+        if label in self.hourly_artists:
+            return
         # A 'simple' plot
-        self.daily_ax.plot('T', '-', picker=10, label=label, data=df,
-                           **next(self.style_cycle))
-        # update the legend
-        self.daily_ax.legend()
-        # ask the GUI to redraw the next time it can
-        self.daily_ax.figure.canvas.draw_idle()
+        lines = self.daily_ax.plot('T', '-', picker=10, label=label, gid=label,
+                                   data=df, **next(self.style_cycle))
+        self.hourly_artists[label] = lines
+        self._connect(self.daily_ax, label, self._daily_on_pick)
+        self._track(self.daily_ax, lines)
+        # update the legend and redraw
+        self._refresh(self.daily_ax)
 
     def _daily_on_pick(self, event):
-        if event.mouseevent.inaxes is not self.daily_ax:
-            return
-        # grab the canvas
-        canvas = event.artist.figure.canvas
         # remove the artist
-        event.artist.remove()
-        # update the legend
-        self.daily_ax.legend()
-        # redraw the canvas next time it is convenient
-        canvas.draw_idle()
+        self._remove_day(event.artist.get_gid())
+        # update the legend and redraw
+        self._refresh(self.daily_ax)
 
-    def remove(self):
+    def _remove_month(self, label):
+        self.daily_index.pop(label, None)
+        arts = self.daily_artists.pop(label, [])
+        self._disconnect(label)
+        for art in arts:
+            self._untrack(self.monthly_ax,
+                          art.get_children() if art in
+                          self.monthly_ax.containers else [art])
+            art.remove()
+            # work around a bug! (older Matplotlib leaves it behind)
+            if art in self.monthly_ax.containers:
+                self.monthly_ax.containers.remove(art)
+
+    def _remove_day(self, label):
+        lines = self.hourly_artists.pop(label, [])
+        self._disconnect(label)
+        self._untrack(self.daily_ax, lines)
+        for line in lines:
+            line.remove()
+
+    def _clear_picks(self):
+        '''Remove every month / day plotted from picks
+        '''
+        for label in list(self.daily_artists):
+            self._remove_month(label)
+        for label in list(self.hourly_artists):
+            self._remove_day(label)
+
+    def _remove_yearly(self):
+        self._disconnect(self.label)
         for art in self.yearly_art:
             art.remove()
+            # same work around as in `_remove_month`
+            if art in self.yearly_ax.containers:
+                self.yearly_ax.containers.remove(art)
         self.yearly_art = None
-        self.yearly_ax.figure.canvas.mpl_disconnect(self.cid)
+
+    def _track(self, ax, artists):
+        '''Hand new artists to the blit manager (if we have one)
+        '''
+        if self.blit_manager is not None:
+            for art in artists:
+                self.blit_manager.add_artist(ax, art)
+
+    def _untrack(self, ax, artists):
+        if self.blit_manager is not None:
+            for art in artists:
+                self.blit_manager.remove_artist(ax, art)
+
+    def _refresh(self, ax):
+        '''Update the legend of ``ax`` and get it redrawn
+        '''
+        if self.blit_manager is None:
+            handles, labels = ax.get_legend_handles_labels()
+            if labels:
+                ax.legend(handles, labels)
+            elif ax.get_legend() is not None:
+                ax.get_legend().remove()
+            ax.figure.canvas.draw_idle()
+        else:
+            self.blit_manager.update_legend(ax)
+            self.blit_manager.update(ax)
+
+    def remove(self):
+        self._clear_picks()
+        self._remove_yearly()
+        for gid in list(self._connections):
+            self._disconnect(gid)
+
+
+class AggregatedTimeTraces:
+    def __init__(self, datasets, yearly_ax, monthly_ax, daily_ax,
+                 style_cycle=None, slice_cache=None, blit=False,
+                 router=None, aggregates=None):
+        '''Compare several data sets on the same 3 axes
+
+        The data sets without `aggregates` are aggregated together (see
+        `aggregate_many`) and share one style cycle, slice cache, event
+        router and
+        (optionally) blit manager.  The router looks up the handler for
+        the picked artist directly, so picking does not get slower as
+        data sets are added.
+
+        Parameters
+        ----------
+        datasets : dict
+            Maps label to hourly temperature data
+
+        yearly_ax, monthly_ax, daily_ax : Axes
+            See `AggregatedTimeTrace`
+
+        style_cycle : Cycler, optional
+            Style to use for plotting, shared across all data sets
+
+        slice_cache : SliceCache, optional
+            Shared between all data sets
+
+        blit : bool or BlitManager, optional
+            See `AggregatedTimeTrace`
+
+        router : EventRouter, optional
+            See `AggregatedTimeTrace`
+
+        aggregates : dict, optional
+            Maps label to the already computed output of `aggregate` (or
+            `load_aggregates`) for some of the data sets
+        '''
+        canvas = yearly_ax.figure.canvas
+        if blit is True and getattr(canvas, 'supports_blit', True):
+            blit = BlitManager(canvas)
+        if slice_cache is None:
+            slice_cache = SliceCache()
+        if isinstance(style_cycle, Cycler):
+            style_cycle = style_cycle()
+        if router is None:
+            router = get_router(canvas)
+        self.router = router
+        self.traces = {}
+        aggs = dict(aggregates or {})
+        aggs.update(aggregate_many({k: hourly
+                                    for k, hourly in datasets.items()
+                                    if k not in aggs}))
+        for label, hourly in datasets.items():
+            trace = AggregatedTimeTrace(
+                hourly, label, yearly_ax, monthly_ax, daily_ax,
+                agg_by_day=aggs[label]['day'],
+                agg_by_month=aggs[label]['month'],
+                style_cycle=style_cycle, slice_cache=slice_cache,
+                blit=blit, router=router)
+            # after the first trace makes the defaults, share them
+            style_cycle = trace.style_cycle
+            blit = trace.blit_manager or False
+            self.traces[label] = trace
+
+    @classmethod
+    def from_datasets(cls, datasets, yearly_ax, monthly_ax, daily_ax,
+                      **kwargs):
+        '''Compare datasets using their pre-computed aggregates
+
+        Parameters
+        ----------
+        datasets : iterable of str
+            Loaded with `load_data`, the aggregates with `load_aggregates`
+
+        yearly_ax, monthly_ax, daily_ax : Axes
+            See `AggregatedTimeTrace`
+
+        **kwargs
+            Passed on to `__init__`
+        '''
+        datasets = list(datasets)
+        return cls({k: load_data(k) for k in datasets},
+                   yearly_ax, monthly_ax, daily_ax,
+                   aggregates={k: load_aggregates(k) for k in datasets},
+                   **kwargs)
+
+    def __getitem__(self, label):
+        return self.traces[label]
+
+    def remove(self):
+        for trace in self.traces.values():
+            trace.remove()
+        self.traces = {}
 
 
-temperature = load_data('mdw')
 fig, (ax_by_month, ax_by_day, ax_by_hour) = setup_temperature_figure()
-temperature_at = AggregatedTimeTrace(temperature, 'temperature',
-                                     ax_by_month, ax_by_day, ax_by_hour)
+temperature_at = AggregatedTimeTrace.from_dataset(
+    'mdw', ax_by_month, ax_by_day, ax_by_hour, label='temperature')
+temperature = temperature_at.data_by_hour
 fig.suptitle('Temperature')
 plt.show()
 
+# to compare several stations on one figure
+# fig, (ax_by_month, ax_by_day, ax_by_hour) = setup_temperature_figure()
+# comparison = AggregatedTimeTraces.from_datasets(
+#     ('mdw', 'bwi', 'central_park'), ax_by_month, ax_by_day, ax_by_hour)
+
+# to see which handlers make the figure feel slow
+# from w_helpers import LatencyMonitor, get_router
+# monitor = LatencyMonitor(fig.canvas)
+# monitor.attach(get_router(fig.canvas))
+# monitor.enable()
+# monitor.show_overlay()
+# ... click around, then monitor.summary() or monitor.to_csv('lat.csv')
+
 # EXERCISE (15 minutes)
 # - plot 3 day windows centered on picked day
 # - cycle through min/max, std bands, and no bands on key stroke
@@ -0,0 +1,80 @@
+"""Micro-benchmarks for the helpers in w_helpers
+
+Run as ``%run -i 98-benchmarks.py``
+"""
+import timeit
+
+import numpy as np
+import pandas as pd
+from w_helpers import (aggregate_by_day, day_offsets, extract_day_of_hourly,
+                       extract_month_of_daily)
+
+
+def synthetic_hourly(years, start='1950'):
+    '''Make a fake hourly record ``years`` long
+    '''
+    index = pd.date_range(start, periods=int(years * 365.25 * 24),
+                          freq=pd.Timedelta(hours=1), name='datetime')
+    rng = np.random.RandomState(0)
+    return pd.DataFrame({'year': index.year,
+                         'month': index.month,
+                         'day': index.day,
+                         'hour': index.hour,
+                         'T': rng.normal(10, 10, len(index))},
+                        index=index)
+
+
+def masked_extract_day(hourly_df, year, month, day):
+    '''The boolean mask version of `extract_day_of_hourly`, for comparison
+    '''
+    ix = ((hourly_df['month'] == month) &
+          (hourly_df['year'] == year) &
+          (hourly_df['day'] == day))
+    df = hourly_df[ix]
+    midnight = pd.Timestamp(year, month, day)
+    df.index = [(m - midnight).seconds / 3600 for m in df.index]
+    return df
+
+
+def time_per_call(func, number=20):
+    return min(timeit.repeat(func, number=number, repeat=3)) / number
+
+
+def bench_extract(lengths=(1, 4, 16, 64)):
+    '''Time extracting a single day / month as the record gets longer
+
+    Parameters
+    ----------
+    lengths : iterable of int
+        Lengths of the records to try, in years
+
+    Returns
+    -------
+    DataFrame
+        Milliseconds per call, indexed by record length
+    '''
+    results = []
+    for years in lengths:
+        hourly = synthetic_hourly(years)
+        daily = aggregate_by_day(hourly)
+        offsets = day_offsets(hourly)
+        mid = hourly.index[len(hourly) // 2]
+        day = (hourly, mid.year, mid.month, mid.day)
+        results.append({
+            'years': years,
+            'rows': len(hourly),
+            'day, mask [ms]': time_per_call(
+                lambda: masked_extract_day(*day)),
+            'day, search [ms]': time_per_call(
+                lambda: extract_day_of_hourly(*day)),
+            'day, table [ms]': time_per_call(
+                lambda: extract_day_of_hourly(*day, offsets=offsets)),
+            'month [ms]': time_per_call(
+                lambda: extract_month_of_daily(daily, mid.year, mid.month)),
+        })
+    results = pd.DataFrame(results).set_index('years')
+    results.iloc[:, 1:] *= 1e3
+    return results
+
+
+print(bench_extract())
@@ -1,93 +1,1123 @@
-from urllib.request import urlopen
+from urllib.request import urlopen, Request
+from urllib.error import HTTPError
+from concurrent.futures import (ThreadPoolExecutor, ProcessPoolExecutor,
+                                as_completed)
+from functools import partial
 import gzip
+import hashlib
+import json
+import threading
 
 import os
 import os.path
-import datetime
+import tempfile
+import time
 
 import numpy as np
 import pandas as pd
+from scipy.spatial import cKDTree
 
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 
 import cartopy
 import cartopy.crs
 import cartopy.feature as cfeature
 
+from w_helpers import load_data, get_router, read_tagged, write_tagged
+from isd import (injest_file_by_line, injest_file, parsed_cache_path,
+                 injest_cached)
+
 plt.ion()
 
 
+CHUNK_SIZE = 2**16
+
+
+def _file_digest(fname, chunk_size=CHUNK_SIZE):
+    '''Return the size and sha256 hex digest of a file
+    '''
+    sha = hashlib.sha256()
+    size = 0
+    with open(fname, 'rb') as fin:
+        for chunk in iter(partial(fin.read, chunk_size), b''):
+            sha.update(chunk)
+            size += len(chunk)
+    return size, sha.hexdigest()
+
+
+def _is_complete_gzip(fname, chunk_size=CHUNK_SIZE):
+    '''Check that a gzip file decompresses all the way to the end
+    '''
+    try:
+        with gzip.open(fname, 'rb') as fin:
+            for chunk in iter(partial(fin.read, chunk_size), b''):
+                pass
+    except (EOFError, OSError):
+        return False
+    return True
+
+
+class CacheIndex:
+    '''Size and checksum of every complete file in the download cache
+
+    The index is stored as json in ``{data_dir}/index.json`` and is keyed
+    on the path relative to ``data_dir``.  A file is only ever recorded
+    once it has been completely downloaded, so membership in the index
+    is what makes a cache hit.
+
+    Parameters
+    ----------
+    data_dir : str
+        The root of the download cache
+    '''
+    fname = 'index.json'
+
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        self.path = os.path.join(data_dir, self.fname)
+        self._lock = threading.Lock()
+        try:
+            with open(self.path) as fin:
+                self.entries = json.load(fin)
+        except FileNotFoundError:
+            self.entries = {}
+
+    def _key(self, target_file):
+        return os.path.relpath(target_file, self.data_dir).replace(os.sep, '/')
+
+    def __contains__(self, target_file):
+        return self._key(target_file) in self.entries
+
+    def get(self, target_file):
+        return self.entries.get(self._key(target_file))
+
+    def record(self, target_file, size, sha256):
+        with self._lock:
+            self.entries[self._key(target_file)] = {'size': size,
+                                                    'sha256': sha256}
+            self._save()
+
+    def discard(self, target_file):
+        with self._lock:
+            if self.entries.pop(self._key(target_file), None) is not None:
+                self._save()
+
+    def verify(self, target_file):
+        '''Check a cached file against its recorded size and checksum
+        '''
+        entry = self.get(target_file)
+        if entry is None:
+            return False
+        try:
+            if os.path.getsize(target_file) != entry['size']:
+                return False
+            return _file_digest(target_file) == (entry['size'],
+                                                 entry['sha256'])
+        except FileNotFoundError:
+            return False
+
+    def verify_all(self):
+        '''Drop every entry that does not match the file on disk
+
+        Returns
+        -------
+        list of str
+            The files that were dropped
+        '''
+        bad = [os.path.join(self.data_dir, k) for k in list(self.entries)
+               if not self.verify(os.path.join(self.data_dir, k))]
+        for target_file in bad:
+            self.discard(target_file)
+        return bad
+
+    def _save(self):
+        os.makedirs(self.data_dir, exist_ok=True)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as fout:
+            json.dump(self.entries, fout, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+
+
+def fetch_to_cache(url_target, target_file, index, chunk_size=CHUNK_SIZE):
+    '''Stream a url into the cache
+
+    The data is written to ``target_file + '.part'`` in chunks and only
+    renamed to ``target_file`` once it is complete.  If a partial file
+    is left over from an interrupted transfer we ask (http) servers for
+    the rest of it, otherwise we start over.
+
+    Parameters
+    ----------
+    url_target : str
+        Where to get the file from
+
+    target_file : str
+        Where to put it
+
+    index : CacheIndex
+        The completed file is recorded here
+
+    chunk_size : int, optional
+        Number of bytes to read / write at a time
+    '''
+    part_file = target_file + '.part'
+    os.makedirs(os.path.dirname(target_file), exist_ok=True)
+    sha = hashlib.sha256()
+    offset = 0
+    if os.path.exists(part_file):
+        with open(part_file, 'rb') as fin:
+            for chunk in iter(partial(fin.read, chunk_size), b''):
+                sha.update(chunk)
+                offset += len(chunk)
+
+    request = Request(url_target)
+    if offset and url_target.startswith('http'):
+        request.add_header('Range', f'bytes={offset}-')
+    print(url_target)
+    try:
+        response = urlopen(request)
+    except HTTPError as e:
+        if e.code != 416:
+            raise
+        # our partial file is no good to the server, start over
+        os.remove(part_file)
+        return fetch_to_cache(url_target, target_file, index, chunk_size)
+
+    with response:
+        if getattr(response, 'status', None) != 206:
+            # not resuming (or the server ignored the range)
+            sha = hashlib.sha256()
+            offset = 0
+        else:
+            # 'bytes {start}-{end}/{total}', only append if it picks up
+            # exactly where our partial file stops
+            content_range = response.headers.get('Content-Range', '')
+            start = content_range.partition(' ')[2].partition('-')[0]
+            if start.strip() != str(offset):
+                os.remove(part_file)
+                return fetch_to_cache(url_target, target_file, index,
+                                      chunk_size)
+        expected = response.headers.get('Content-Length')
+        received = 0
+        with open(part_file, 'ab' if offset else 'wb') as fout:
+            for chunk in iter(partial(response.read, chunk_size), b''):
+                fout.write(chunk)
+                sha.update(chunk)
+                received += len(chunk)
+
+    if expected is not None and received != int(expected):
+        raise IOError(f'{url_target}: expected {expected} bytes, got '
+                      f'{received}.  Run again to resume.')
+    os.replace(part_file, target_file)
+    index.record(target_file, offset + received, sha.hexdigest())
+    return target_file
+
+
+def fetch_cached(url_target, target_file, index, allow_download=True,
+                 verify=False):
+    '''Get a file from the cache, downloading it if needed
+
+    Parameters
+    ----------
+    url_target : str
+        Where to get the file from if it is not cached
+
+    target_file : str
+        Where the file lives in the cache
+
+    index : CacheIndex
+        The cache index
+
+    allow_download : bool, optional
+        If False, only use what is already in the cache
+
+    verify : bool, optional
+        If True, check the size and checksum of cache hits and re-fetch
+        any that do not match
+
+    Returns
+    -------
+    str
+        ``target_file``
+    '''
+    if target_file in index:
+        # trusted without touching the file, callers that find it has
+        # been deleted `discard` it and fetch again
+        if not verify or index.verify(target_file):
+            return target_file
+        index.discard(target_file)
+    elif os.path.exists(target_file):
+        # left over from before there was an index, adopt it if it is
+        # not truncated
+        if not target_file.endswith('.gz') or _is_complete_gzip(target_file):
+            index.record(target_file, *_file_digest(target_file))
+            return target_file
+    if allow_download:
+        fetch_to_cache(url_target, target_file, index)
+    return target_file
+
+
+# USAF ids are kept as zero padded strings, some are not numbers
+USAF_WIDTH = 6
+ISD_HISTORY_DTYPES = {'USAF': str,
+                      'WBAN': 'int32',
+                      'STATION NAME': str,
+                      'CTRY': 'category',
+                      'STATE': 'category',
+                      'ICAO': str,
+                      'LAT': 'float32',
+                      'LON': 'float32',
+                      'ELEV(M)': 'float32',
+                      'BEGIN': 'int32',
+                      'END': 'int32'}
+
+
+class ISDHistory:
+    def __init__(self, table):
+        '''Indexed queries over the ISD station list
+
+        Parameters
+        ----------
+        table : DataFrame
+            The contents of isd-history.csv, see `load_isd_history`
+        '''
+        self.table = table
+        # sorted views for binary search
+        begin = table['BEGIN'].values
+        self._by_begin = np.argsort(begin, kind='mergesort')
+        self._sorted_begin = begin[self._by_begin]
+        lon = table['LON'].values
+        by_lon = np.argsort(lon, kind='mergesort')
+        self._by_lon = by_lon[np.isfinite(lon[by_lon])]
+        self._sorted_lon = lon[self._by_lon]
+        self._ids = pd.MultiIndex.from_arrays([table['USAF'].values,
+                                               table['WBAN'].values])
+
+    def __len__(self):
+        return len(self.table)
+
+    def _rows(self, positions):
+        return self.table.iloc[np.sort(positions)]
+
+    def covering(self, s_date=None, f_date=None):
+        '''Stations with data from before s_date through after f_date
+
+        Parameters
+        ----------
+        s_date, f_date : int, optional
+            Dates as YYYYMMDD integers
+
+        Returns
+        -------
+        DataFrame
+            The matching rows, in the order of the table
+        '''
+        if s_date is None:
+            cand = np.arange(len(self))
+        else:
+            cand = self._by_begin[:np.searchsorted(self._sorted_begin,
+                                                   s_date)]
+        if f_date is not None:
+            cand = cand[self.table['END'].values[cand] > f_date]
+        return self._rows(cand)
+
+    def in_bbox(self, lon0, lon1, lat0, lat1):
+        '''Stations inside a longitude / latitude box
+
+        Returns
+        -------
+        DataFrame
+            The matching rows, in the order of the table
+        '''
+        # inclusive at both ends, like the latitude test
+        lo = np.searchsorted(self._sorted_lon, lon0, side='left')
+        hi = np.searchsorted(self._sorted_lon, lon1, side='right')
+        cand = self._by_lon[lo:hi]
+        lat = self.table['LAT'].values[cand]
+        return self._rows(cand[(lat >= lat0) & (lat <= lat1)])
+
+    def lookup(self, usaf, wban):
+        '''The row(s) for a USAF / WBAN id
+        '''
+        loc = self._ids.get_loc((str(usaf).zfill(USAF_WIDTH), int(wban)))
+        if isinstance(loc, (int, np.integer)):
+            loc = [loc]
+        return self.table.iloc[loc]
+
+
+def load_isd_history(data_dir, allow_download=True):
+    '''Load isd-history.csv with explicit dtypes, via a binary cache
+
+    The first time the csv is parsed it is stored (as an HDF5 table) in
+    ``{data_dir}/isd-history.h5`` tagged with the checksum of the csv.
+    Later calls read that instead as long as the csv has not changed.
+
+    Parameters
+    ----------
+    data_dir : str
+        The download cache
+
+    allow_download : bool, optional
+        If False, only use a copy of the csv already in the cache
+
+    Returns
+    -------
+    ISDHistory
+    '''
+    target_file = os.path.join(data_dir, 'isd-history.csv')
+    parsed_file = os.path.join(data_dir, 'isd-history.h5')
+
+    os.makedirs(data_dir, exist_ok=True)
+    index = CacheIndex(data_dir)
+    url_target = 'ftp://ftp.ncdc.noaa.gov/pub/data/noaa/isd-history.csv'
+
+    def fetch():
+        fetch_cached(url_target, target_file, index,
+                     allow_download=allow_download)
+        if target_file not in index:
+            raise FileNotFoundError(f'{target_file} is not cached and '
+                                    'allow_download is False')
+        return index.get(target_file)['sha256']
+
+    source_sha256 = fetch()
+    stored = read_tagged(parsed_file, ['isd'], source_sha256=source_sha256)
+    if stored is not None:
+        return ISDHistory(stored['isd'])
+
+    try:
+        table = pd.read_csv(target_file, dtype=ISD_HISTORY_DTYPES)
+    except FileNotFoundError:
+        # deleted since it was indexed
+        index.discard(target_file)
+        source_sha256 = fetch()
+        table = pd.read_csv(target_file, dtype=ISD_HISTORY_DTYPES)
+    table['USAF'] = table['USAF'].str.zfill(USAF_WIDTH)
+    table['TEMPLATE'] = station_templates(table)
+    write_tagged(parsed_file, {'isd': table}, format='table',
+                 source_sha256=source_sha256)
+    return ISDHistory(table)
+
+
 def get_filtered_isd(data_dir, s_date=None, f_date=None,
                      allow_download=True):
-    fname = 'isd-history.csv'
-    target_file = os.path.join(data_dir, fname)
+    isd_history = load_isd_history(data_dir, allow_download=allow_download)
+    return isd_history.covering(s_date, f_date)
 
-    os.makedirs(data_dir, exist_ok=True)
-    if not os.path.exists(target_file) and allow_download:
-        url_target = 'ftp://ftp.ncdc.noaa.gov/pub/data/noaa/isd-history.csv'
-        with open(target_file, 'wb') as fout:
-            print(url_target)
-            fout.write(urlopen(url_target).read())
 
-    isd_history = pd.read_csv(target_file)
-    if s_date is not None:
-        isd_history = isd_history[isd_history['BEGIN'] < s_date]
-    if f_date is not None:
-        isd_history = isd_history[isd_history['END'] > f_date]
+def write_isd_records(hourly, fname, max_additional=0, seed=0):
+    '''Write hourly temperature data back out as (minimal) ISD records
 
-    return isd_history
+    Only the date/time and temperature fields are filled in, everything
+    else is padding.  This is enough to round-trip through `injest_file`.
 
+    Parameters
+    ----------
+    hourly : DataFrame
+        Must have a time index and a 'T' column
 
-def extract_date_time(row):
+    fname : str
+        The gzip file to write to
+
+    max_additional : int, optional
+        Real records carry a variable length additional data section
+        after the mandatory one.  If non-zero each record gets one of
+        between 0 and this many (filler) characters.
+
+    seed : int, optional
+        Seed for the lengths of the additional data sections
     '''
+    t = np.round(hourly['T'].values * 10)
+    t = np.where(np.isnan(t), 9999, t).astype(int)
+    extra = np.random.RandomState(seed).randint(0, max_additional + 1,
+                                                len(t))
+    with gzip.open(fname, 'wt', encoding='ascii') as fout:
+        for dt, v, n in zip(hourly.index, t, extra):
+            fout.write('{:015d}{:%Y%m%d%H%M}{:060d}{:+05d}{:013d}{}\n'.format(
+                0, dt, 0, v, 0, 'ADD' + 'X' * n if n else ''))
+
+
+def benchmark_injest(datasets=('mdw', 'bwi', 'central_park'), repeat=3,
+                     max_additional=(0, 2000)):
+    '''Compare `injest_file` to `injest_file_by_line` on the bundled data
+
+    The bundled data sets are written back out as ISD records to a
+    temporary directory and then parsed with both implementations.
+
+    Parameters
+    ----------
+    datasets : iterable of str
+        Names of data sets in ``data/``
+
+    repeat : int, optional
+        Number of times to parse each file, the fastest is reported
+
+    max_additional : iterable of int, optional
+        Lengths of additional data section to try, see
+        `write_isd_records`.  0 gives bare 105 character records.
+
+    Returns
+    -------
+    DataFrame
+        Rows and best time [s] for each implementation, indexed by data
+        set and `max_additional`
     '''
-    fmt_str = '%Y%m%d%H%M'
-    dt = datetime.datetime.strptime(row[15:27], fmt_str)
-    return dt, dt.year, dt.month, dt.day, dt.hour
+    def best_of(func, fname):
+        times = []
+        for j in range(repeat):
+            start = time.perf_counter()
+            ret = func(fname)
+            times.append(time.perf_counter() - start)
+        return min(times), ret
+
+    results = []
+    with tempfile.TemporaryDirectory() as td:
+        for dataset in datasets:
+            hourly = load_data(dataset)
+            for additional in max_additional:
+                fname = os.path.join(td, f'{dataset}-{additional}.gz')
+                write_isd_records(hourly, fname, max_additional=additional)
+                by_line, expected = best_of(injest_file_by_line, fname)
+                vectorized, actual = best_of(injest_file, fname)
+                pd.testing.assert_frame_equal(actual, expected,
+                                              check_dtype=False)
+                results.append({'dataset': dataset,
+                                'max_additional': additional,
+                                'rows': len(actual),
+                                'by_line': by_line,
+                                'vectorized': vectorized})
+    results = pd.DataFrame(results).set_index(['dataset', 'max_additional'])
+    results['speedup'] = results['by_line'] / results['vectorized']
+    return results
 
 
-def extract_temperature(row):
-    t = int(row[87:92])
-    if t == 9999:
-        return (np.nan, )
-    return (t / 10,)
+class ISDCache:
+    '''Fetch ISD files through the local cache and prepare them for parsing
+
+    Shared by `get_hourly_data` and `get_multi_station_data`, see
+    `get_hourly_data` for the parameters.
+    '''
+    def __init__(self, data_dir, urlbase, allow_download=True, verify=False,
+                 parsed_cache=True, compact=False):
+        self.data_dir = data_dir
+        self.urlbase = urlbase
+        self.allow_download = allow_download
+        self.verify = verify
+        self.parsed_cache = parsed_cache
+        self.compact = compact
+        self.index = CacheIndex(data_dir)
 
+    def target_file(self, template, year):
+        return os.path.join(self.data_dir, str(year),
+                            template.format(year=year))
 
-def injest_file(fname):
-    with gzip.open(fname, 'rt', encoding='ascii') as f:
-        data = [extract_date_time(ln) + extract_temperature(ln)
-                for ln in f]
+    def fetch(self, template, year):
+        '''Make sure ``{data_dir}/{year}/{template}`` is cached
 
-    return pd.DataFrame(data,
-                        columns=('datetime', 'year', 'month',
-                                 'day', 'hour', 'T')).dropna()
+        Returns
+        -------
+        str
+            The local file name
+        '''
+        url = '/'.join((self.urlbase, template)).format(year=year)
+        return fetch_cached(url, self.target_file(template, year),
+                            self.index, allow_download=self.allow_download,
+                            verify=self.verify)
+
+    def injest(self, template, year):
+        '''Fetch and parse a file in this process
+
+        If the file has been deleted since it was indexed it is fetched
+        again, so this is also the fallback for a parse on a worker
+        process that raised `FileNotFoundError`.
+        '''
+        try:
+            return injest_cached(*self.injest_args(self.fetch(template,
+                                                              year)))
+        except FileNotFoundError:
+            self.index.discard(self.target_file(template, year))
+            return injest_cached(*self.injest_args(self.fetch(template,
+                                                              year)))
+
+    def injest_args(self, target_file):
+        '''The arguments to pass `isd.injest_cached` for a cached file
+        '''
+        entry = self.index.get(target_file) if self.parsed_cache else None
+        return (target_file, parsed_cache_path(target_file, self.data_dir),
+                entry and entry['sha256'], self.compact)
 
 
 def get_hourly_data(data_dir, template, years, allow_download=True,
-                    urlbase='ftp://ftp.ncdc.noaa.gov/pub/data/noaa/{year}'):
+                    urlbase='ftp://ftp.ncdc.noaa.gov/pub/data/noaa/{year}',
+                    max_workers=None, verify=False, parsed_cache=True,
+                    compact=False):
+    '''Get hourly temperature data for a station, downloading as needed
+
+    Parameters
+    ----------
+    data_dir : str
+        The local cache, files are stored as ``{data_dir}/{year}/{template}``
+
+    template : str
+        File name template, like ``'{USAF}-{WBAN}-{{year}}.gz'``
 
-    data_dir_template = os.path.join(data_dir, '{year}')
-    target_template = os.path.join(data_dir_template, template)
-    url_template = '/'.join((urlbase, template))
-    data = []
+    years : iterable of int
+        The years to get data for
 
-    for year in years:
-        os.makedirs(data_dir_template.format(year=year), exist_ok=True)
+    allow_download : bool, optional
+        If False, only use files already in the cache
 
-        target_file = target_template.format(year=year)
+    urlbase : str, optional
+        Where to fetch missing files from.  Anything `urlopen` understands
+        works, including ``'file:///path/to/mirror/{year}'``
 
-        if not os.path.exists(target_file) and allow_download:
-            url_target = url_template.format(year=year)
-            with open(target_file, 'wb') as fout:
-                print(url_target)
-                fout.write(urlopen(url_target).read())
+    max_workers : int, optional
+        If given, download on a thread pool and parse on a process pool
+        with this many workers each.  Otherwise work through the years
+        one at a time.
 
-        data.append(injest_file(target_file))
+    verify : bool, optional
+        If True, check cached files against their recorded size and
+        checksum and re-download any that do not match
+
+    parsed_cache : bool, optional
+        If True, keep a parsed copy of each file under
+        ``{data_dir}/parsed`` and use it instead of re-parsing the raw
+        file when the raw file has not changed
+
+    compact : bool, optional
+        If True, return the compact schema (see `w_helpers.compact_dtypes`)
+
+    Returns
+    -------
+    DataFrame
+        Hourly data indexed by time, in the order of `years`
+    '''
+    cache = ISDCache(data_dir, urlbase, allow_download=allow_download,
+                     verify=verify, parsed_cache=parsed_cache,
+                     compact=compact)
+    if max_workers is None:
+        data = [cache.injest(template, year) for year in years]
+    else:
+        with ThreadPoolExecutor(max_workers) as io_pool, \
+                ProcessPoolExecutor(max_workers) as cpu_pool:
+            # parsing a year starts as soon as its download is done while
+            # the later downloads are still in flight
+            fetched = [io_pool.submit(cache.fetch, template, year)
+                       for year in years]
+            parsed = [cpu_pool.submit(injest_cached,
+                                      *cache.injest_args(f.result()))
+                      for f in fetched]
+            data = []
+            for year, p in zip(years, parsed):
+                try:
+                    data.append(p.result())
+                except FileNotFoundError:
+                    data.append(cache.injest(template, year))
     data = pd.concat(data)
     data.set_index('datetime', inplace=True)
     return data
 
 
+def print_progress(done, total, station, year, error):
+    '''Default progress report for `get_multi_station_data`
+    '''
+    status = 'ok' if error is None else 'FAILED ({!r})'.format(error)
+    print('[{}/{}] {} {}: {}'.format(done, total, station, year, status))
+
+
+def get_multi_station_data(
+        data_dir, templates, years, max_workers=4, allow_download=True,
+        urlbase='ftp://ftp.ncdc.noaa.gov/pub/data/noaa/{year}',
+        verify=False, parsed_cache=True, compact=False,
+        progress=print_progress):
+    '''Get hourly data for many stations at once
+
+    All of the station-years are downloaded on a thread pool and parsed
+    on a process pool, each with at most `max_workers` workers.  A
+    station-year that fails (NOAA does not have a file for every
+    station every year) is reported and skipped rather than aborting
+    the batch.
+
+    Parameters
+    ----------
+    data_dir : str
+        The local cache, see `get_hourly_data`
+
+    templates : dict
+        Maps station name to file name template
+
+    years : iterable of int
+        The years to get data for
+
+    max_workers : int, optional
+        The number of downloads / parses in flight at once
+
+    allow_download, urlbase, verify, parsed_cache, compact
+        As for `get_hourly_data`
+
+    progress : callable, optional
+        Called as ``progress(done, total, station, year, error)`` as each
+        station-year finishes, `error` is None on success.  Pass None
+        to be quiet.
+
+    Returns
+    -------
+    data : DataFrame
+        Hourly data indexed by (station, datetime)
+
+    failures : dict
+        Maps station name to ``{year: exception}`` for every station-year
+        that could not be fetched or parsed
+    '''
+    years = list(years)
+    cache = ISDCache(data_dir, urlbase, allow_download=allow_download,
+                     verify=verify, parsed_cache=parsed_cache,
+                     compact=compact)
+    jobs = [(station, year) for station in templates for year in years]
+    total = len(jobs)
+    results = {}
+    failures = {}
+
+    def finish(job, error=None):
+        station, year = job
+        if error is not None:
+            failures.setdefault(station, {})[year] = error
+        if progress is not None:
+            progress(len(results) + sum(map(len, failures.values())),
+                     total, station, year, error)
+
+    with ThreadPoolExecutor(max_workers) as io_pool, \
+            ProcessPoolExecutor(max_workers) as cpu_pool:
+        fetched = {io_pool.submit(cache.fetch, templates[station], year):
+                   (station, year) for station, year in jobs}
+        parsing = {}
+        # hand each file to the parsers as soon as its download is done
+        for f in as_completed(fetched):
+            job = fetched[f]
+            try:
+                target_file = f.result()
+            except Exception as e:
+                finish(job, e)
+                continue
+            parsing[cpu_pool.submit(injest_cached,
+                                    *cache.injest_args(target_file))] = job
+        for p in as_completed(parsing):
+            job = parsing[p]
+            station, year = job
+            try:
+                try:
+                    df = p.result()
+                except FileNotFoundError:
+                    df = cache.injest(templates[station], year)
+                results[job] = df.set_index('datetime')
+            except Exception as e:
+                finish(job, e)
+                continue
+            finish(job)
+
+    stations = [station for station in templates
+                if any((station, year) in results for year in years)]
+    if not stations:
+        return pd.DataFrame(), failures
+    data = pd.concat([pd.concat([results[station, year] for year in years
+                                 if (station, year) in results])
+                      for station in stations],
+                     keys=stations, names=['station', 'datetime'])
+    return data, failures
+
+
+class StationIndex:
+    def __init__(self, lon, lat, pick_radius=10):
+        '''A k-d tree of station locations, usable as a picker
+
+        Parameters
+        ----------
+        lon, lat : array
+            The station locations, in the data coordinates of the axes
+            they will be plotted on.  Stations with non-finite locations
+            are never picked.
+
+        pick_radius : float, optional
+            The pick radius in points
+        '''
+        lon = np.asarray(lon, dtype=float)
+        lat = np.asarray(lat, dtype=float)
+        # positions of the stations that are in the tree
+        self.valid = np.flatnonzero(np.isfinite(lon) & np.isfinite(lat))
+        self.tree = cKDTree(np.column_stack([lon[self.valid],
+                                             lat[self.valid]]))
+        self.pick_radius = pick_radius
+
+    def query(self, ax, x, y, radius):
+        '''Find the stations near a point on the screen
+
+        Parameters
+        ----------
+        ax : Axes
+            The axes the stations are plotted on
+
+        x, y : float
+            The point in display coordinates
+
+        radius : float
+            The search radius in pixels
+
+        Returns
+        -------
+        array of int
+            Positions of the stations in the input data, nearest first
+        '''
+        to_data = ax.transData.inverted()
+        cx, cy = to_data.transform((x, y))
+        ex, ey = to_data.transform((x + radius, y + radius))
+        rx, ry = abs(ex - cx), abs(ey - cy)
+        # search a circle that covers the ellipse in data space ...
+        candidates = np.asarray(
+            self.tree.query_ball_point((cx, cy), max(rx, ry)), dtype=int)
+        # ... and keep the points within the circle on the screen
+        pts = self.tree.data[candidates]
+        d2 = ((pts[:, 0] - cx) / rx)**2 + ((pts[:, 1] - cy) / ry)**2
+        hit = d2 <= 1
+        return self.valid[candidates[hit][np.argsort(d2[hit])]]
+
+    def __call__(self, artist, mouseevent):
+        if mouseevent.inaxes is not artist.axes:
+            return False, {}
+        radius = self.pick_radius * artist.figure.dpi / 72
+        ind = self.query(artist.axes, mouseevent.x, mouseevent.y, radius)
+        return len(ind) > 0, {'ind': ind}
+
+
+class StationLayer:
+    def __init__(self, ax, lon, lat, *, pick_radius=10, cluster_size=30,
+                 min_cluster=5, **kwargs):
+        '''Draw the stations in view, clustering the dense regions
+
+        The view is divided into cells ``cluster_size`` pixels across.
+        Cells with at least ``min_cluster`` stations are drawn as a single
+        marker (sized by the number of stations) and the rest of the
+        stations are drawn individually.  Stations out of view are not
+        drawn at all.  This is re-done whenever the view limits change.
+        Picking a cluster zooms in on it.
+
+        Parameters
+        ----------
+        ax : Axes
+            The axes to draw to
+
+        lon, lat : array
+            The station locations
+
+        pick_radius : float, optional
+            Pick radius for the individual stations, in points
+
+        cluster_size : float, optional
+            Size of the clustering cells, in pixels
+
+        min_cluster : int, optional
+            The minimum number of stations to draw as a cluster
+
+        **kwargs
+            Passed to ``ax.plot`` for the individual stations
+        '''
+        self.ax = ax
+        self.lon = np.asarray(lon, dtype=float)
+        self.lat = np.asarray(lat, dtype=float)
+        self.cluster_size = cluster_size
+        self.min_cluster = min_cluster
+        # sort on longitude so we can find the stations in view by
+        # binary search
+        self._by_lon = np.argsort(self.lon, kind='mergesort')
+        self._by_lon = self._by_lon[np.isfinite(self.lon[self._by_lon]) &
+                                    np.isfinite(self.lat[self._by_lon])]
+        self._sorted_lon = self.lon[self._by_lon]
+
+        kwargs.setdefault('ms', 5)
+        self.index = StationIndex(self.lon, self.lat, pick_radius)
+        self.stations, = ax.plot([], [], 'o', **kwargs)
+        self.stations.set_picker(self._pick_station)
+        self.clusters = ax.scatter([], [], s=[], picker=True, alpha=.5,
+                                   color=self.stations.get_color(),
+                                   edgecolors='k', zorder=3)
+        # which stations are currently drawn individually
+        self.drawn = np.zeros(len(self.lon), dtype=bool)
+        # station positions in each cluster currently drawn
+        self.members = []
+        self._view = None
+
+        self.cids = [ax.callbacks.connect('xlim_changed', self.update),
+                     ax.callbacks.connect('ylim_changed', self.update)]
+        self.canvas_cids = [
+            ax.figure.canvas.mpl_connect('pick_event', self._on_pick),
+            ax.figure.canvas.mpl_connect('resize_event', self.update)]
+        self.update()
+
+    def in_view(self, x0, x1, y0, y1):
+        '''Positions of the stations inside a rectangle
+        '''
+        lo, hi = np.searchsorted(self._sorted_lon, [x0, x1], side='right')
+        cand = self._by_lon[lo:hi]
+        lat = self.lat[cand]
+        return cand[(lat >= y0) & (lat <= y1)]
+
+    def update(self, *args):
+        ax = self.ax
+        x0, x1 = sorted(ax.get_xlim())
+        y0, y1 = sorted(ax.get_ylim())
+        width, height = ax.bbox.width, ax.bbox.height
+        view = (x0, x1, y0, y1, width, height)
+        # xlim_changed and ylim_changed often come in pairs
+        if view == self._view:
+            return
+        self._view = view
+
+        visible = self.in_view(x0, x1, y0, y1)
+        nx = max(int(width / self.cluster_size), 1)
+        ny = max(int(height / self.cluster_size), 1)
+        cx = np.minimum(((self.lon[visible] - x0) * (nx / (x1 - x0))
+                         ).astype(int), nx - 1)
+        cy = np.minimum(((self.lat[visible] - y0) * (ny / (y1 - y0))
+                         ).astype(int), ny - 1)
+        cells, cell_of, counts = np.unique(cx * ny + cy, return_inverse=True,
+                                           return_counts=True)
+        cell_of = cell_of.ravel()
+        clustered = counts[cell_of] >= self.min_cluster
+
+        singles = visible[~clustered]
+        self.drawn[:] = False
+        self.drawn[singles] = True
+        self.stations.set_data(self.lon[singles], self.lat[singles])
+
+        # group the clustered stations by cell
+        grouped = visible[clustered][np.argsort(cell_of[clustered],
+                                                kind='mergesort')]
+        sizes = counts[counts >= self.min_cluster]
+        self.members = np.split(grouped, np.cumsum(sizes)[:-1])
+        if len(sizes):
+            centers = np.array([(self.lon[m].mean(), self.lat[m].mean())
+                                for m in self.members])
+        else:
+            centers = np.zeros((0, 2))
+        self.clusters.set_offsets(centers)
+        self.clusters.set_sizes(20 * np.sqrt(sizes))
+        ax.figure.canvas.draw_idle()
+
+    def _pick_station(self, artist, mouseevent):
+        hit, props = self.index(artist, mouseevent)
+        if hit:
+            # only the stations we are drawing can be picked
+            ind = props['ind'][self.drawn[props['ind']]]
+            return len(ind) > 0, {'ind': ind}
+        return hit, props
+
+    def _on_pick(self, event):
+        if event.artist is not self.clusters:
+            return
+        members = np.concatenate([self.members[i] for i in event.ind])
+        lon, lat = self.lon[members], self.lat[members]
+        # zoom in on the cluster, with a bit of padding
+        pad_x = max(.1 * np.ptp(lon), .5)
+        pad_y = max(.1 * np.ptp(lat), .5)
+        self.ax.set_xlim(lon.min() - pad_x, lon.max() + pad_x)
+        self.ax.set_ylim(lat.min() - pad_y, lat.max() + pad_y)
+
+    def remove(self):
+        for cid in self.cids:
+            self.ax.callbacks.disconnect(cid)
+        for cid in self.canvas_cids:
+            self.ax.figure.canvas.mpl_disconnect(cid)
+        self.cids = self.canvas_cids = []
+        self.stations.remove()
+        self.clusters.remove()
+
+
+class BasemapTiles:
+    def __init__(self, ax, features, cache_dir=None, name='basemap',
+                 tile_size=256, max_zoom=10, natural_earth_dir=None):
+        '''Draw cartopy features from a cache of pre-rendered tiles
+
+        At zoom level ``z`` the (PlateCarree) world is split into square
+        tiles ``360 / 2**z`` degrees across.  We pick the zoom level that
+        matches the resolution of the axes, render just the tiles in view
+        (once, to png files under ``cache_dir``) and show them as images.
+        Panning and zooming re-uses the rendered tiles, both within and
+        across sessions, rather than re-projecting the vector geometry.
+
+        Parameters
+        ----------
+        ax : GeoAxes
+            A PlateCarree axes to draw to
+
+        features : list of Feature
+            The cartopy features to draw, bottom first
+
+        cache_dir : str, optional
+            Where to keep the tiles, defaults to ``~/data_cache/tiles``.
+            Tiles are kept per ``name`` and ``tile_size``.
+
+        name : str, optional
+            Name of the tile set in the cache.  Use a different name for a
+            different set of features.
+
+        tile_size : int, optional
+            Size of the tiles in pixels
+
+        max_zoom : int, optional
+            The highest zoom level to render
+
+        natural_earth_dir : str, optional
+            A directory of pre-downloaded shapefiles (laid out as
+            ``shapefiles/natural_earth/{category}/...``).  If given,
+            cartopy reads the features from here rather than downloading
+            them.  This only applies while rendering tiles, the global
+            ``cartopy.config`` is restored afterwards.
+        '''
+        if cache_dir is None:
+            cache_dir = os.path.expanduser('~/data_cache/tiles')
+        self.natural_earth_dir = natural_earth_dir
+        self.ax = ax
+        self.cache_dir = os.path.join(cache_dir, name)
+        self.tile_size = tile_size
+        self.max_zoom = max_zoom
+        # (zoom, i, j) -> AxesImage of the tiles currently shown
+        self.images = {}
+        self._view = None
+        self._restoring = False
+
+        # an off-screen axes to render tiles with, only made if needed
+        self.features = features
+        self._tile_ax = None
+
+        self.cids = [ax.callbacks.connect('xlim_changed', self.update),
+                     ax.callbacks.connect('ylim_changed', self.update)]
+        self.canvas_cids = [
+            ax.figure.canvas.mpl_connect('resize_event', self.update)]
+        self.update()
+
+    def zoom_level(self, degrees_per_pixel):
+        '''The coarsest zoom level at least as fine as the screen
+        '''
+        z = np.ceil(np.log2(360 / (self.tile_size * degrees_per_pixel)))
+        return int(np.clip(z, 1, self.max_zoom))
+
+    def tile_path(self, z, i, j):
+        return os.path.join(self.cache_dir, f'{self.tile_size}px', str(z),
+                            f'{i}_{j}.png')
+
+    @staticmethod
+    def tile_extent(z, i, j):
+        '''The (left, right, bottom, top) of a tile in degrees
+        '''
+        width = 360 / 2**z
+        return (-180 + i * width, -180 + (i + 1) * width,
+                90 - (j + 1) * width, 90 - j * width)
+
+    def _render_tile(self, z, i, j):
+        if self._tile_ax is None:
+            fig = Figure(figsize=(self.tile_size / 100,) * 2, dpi=100)
+            FigureCanvasAgg(fig)
+            fig.patch.set_alpha(0)
+            tile_ax = fig.add_axes([0, 0, 1, 1],
+                                   projection=cartopy.crs.PlateCarree())
+            tile_ax.set_axis_off()
+            tile_ax.patch.set_visible(False)
+            for feature in self.features:
+                tile_ax.add_feature(feature)
+            self._tile_ax = tile_ax
+        left, right, bottom, top = self.tile_extent(z, i, j)
+        self._tile_ax.set_xlim(left, right)
+        self._tile_ax.set_ylim(bottom, top)
+
+        fname = self.tile_path(z, i, j)
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        tmp = fname + '.tmp.png'
+        # the features are only read from disk when drawn, so point cartopy
+        # at the pre-downloaded shapefiles just for the draw
+        old_data_dir = cartopy.config['pre_existing_data_dir']
+        if self.natural_earth_dir is not None:
+            cartopy.config['pre_existing_data_dir'] = self.natural_earth_dir
+        try:
+            self._tile_ax.figure.savefig(tmp, dpi=100, transparent=True)
+        finally:
+            cartopy.config['pre_existing_data_dir'] = old_data_dir
+        os.replace(tmp, fname)
+        return fname
+
+    def get_tile(self, z, i, j):
+        '''The RGBA image of a tile, rendering it if it is not cached
+        '''
+        fname = self.tile_path(z, i, j)
+        if not os.path.exists(fname):
+            self._render_tile(z, i, j)
+        return plt.imread(fname)
+
+    def update(self, *args):
+        ax = self.ax
+        x0, x1 = sorted(ax.get_xlim())
+        y0, y1 = sorted(ax.get_ylim())
+        x0, x1 = max(x0, -180), min(x1, 180)
+        y0, y1 = max(y0, -90), min(y1, 90)
+        view = (x0, x1, y0, y1, ax.bbox.width)
+        if (self._restoring or view == self._view or
+                x0 >= x1 or y0 >= y1):
+            return
+        self._view = view
+
+        z = self.zoom_level((x1 - x0) / ax.bbox.width)
+        width = 360 / 2**z
+        i0, i1 = int((x0 + 180) // width), int(np.ceil((x1 + 180) / width))
+        j0, j1 = int((90 - y1) // width), int(np.ceil((90 - y0) / width))
+        wanted = {(z, i, j) for i in range(i0, min(i1, 2**z))
+                  for j in range(j0, min(j1, 2**(z - 1)))}
+
+        for key in set(self.images) - wanted:
+            self.images.pop(key).remove()
+        xlim, ylim = ax.get_xlim(), ax.get_ylim()
+        for key in wanted - set(self.images):
+            self.images[key] = ax.imshow(self.get_tile(*key),
+                                         extent=self.tile_extent(*key),
+                                         origin='upper', zorder=0,
+                                         interpolation='nearest')
+        # imshow may have autoscaled to the tiles, put the limits back
+        self._restoring = True
+        try:
+            ax.set_xlim(xlim)
+            ax.set_ylim(ylim)
+        finally:
+            self._restoring = False
+        ax.figure.canvas.draw_idle()
+
+    def remove(self):
+        for cid in self.cids:
+            self.ax.callbacks.disconnect(cid)
+        for cid in self.canvas_cids:
+            self.ax.figure.canvas.mpl_disconnect(cid)
+        self.cids = self.canvas_cids = []
+        for im in self.images.values():
+            im.remove()
+        self.images = {}
+
+
+def station_templates(rows):
+    '''File name templates for many stations at once
+
+    Parameters
+    ----------
+    rows : DataFrame
+        Rows of isd-history.csv
+
+    Returns
+    -------
+    Series
+        ``'{USAF}-{WBAN}-{year}.gz'`` with the ids filled in, same index
+        as ``rows``
+    '''
+    return (rows['USAF'].astype(str).str.zfill(5) + '-' +
+            rows['WBAN'].astype(str).str.zfill(5) + '-{year}.gz')
+
+
 class StationPicker:
     def __init__(self, station_artist, data, data_path=None):
         if data_path is None:
@@ -96,8 +1126,12 @@ class StationPicker:
         self.event = None
         self.data = data
         self.station_artist = station_artist
-        self.cid = station_artist.figure.canvas.mpl_connect('pick_event',
-                                                            self._id_station)
+        if station_artist.get_gid() is None:
+            station_artist.set_gid('stations-{:x}'.format(id(self)))
+        self.router = get_router(station_artist.figure.canvas)
+        self.cid = self.router.connect('pick_event', self._id_station,
+                                       ax=station_artist.axes,
+                                       gid=station_artist.get_gid())
         self.station_templates = {}
         self.station_rows = {}
 
@@ -109,17 +1143,54 @@ class StationPicker:
         N = len(event.ind)
         if not N:
             return True
-        for i in event.ind:
-            row = self.data.iloc[i]
-            label = row['STATION NAME']
-            tmplate = '{USAF:05d}-{WBAN:05d}-{{year}}.gz'.format(**row)
+        self.select(event.ind)
+
+    def select(self, ind, verbose=True):
+        '''Add stations to the picked set
+
+        Use this to pick many stations at once, for example from the
+        indices returned by a lasso.
+
+        Parameters
+        ----------
+        ind : array of int
+            Positions in ``self.data``
+
+        verbose : bool, optional
+            If True, print each station as it is added
+        '''
+        for label, (row, tmplate) in self.lookup(ind).items():
             self.station_rows[label] = row
             self.station_templates[label] = tmplate
-            print('{!r}: {!r}'.format(label, tmplate))
+            if verbose:
+                print('{!r}: {!r}'.format(label, tmplate))
+
+    def lookup(self, ind):
+        '''Resolve positions in the station table to names and templates
+
+        Parameters
+        ----------
+        ind : array of int
+            Positions in ``self.data``
+
+        Returns
+        -------
+        dict
+            Maps station name to (row, template)
+        '''
+        rows = self.data.iloc[np.asarray(ind, dtype=int)]
+        if 'TEMPLATE' in rows:
+            # pre-computed by load_isd_history
+            templates = rows['TEMPLATE']
+        else:
+            templates = station_templates(rows)
+        return {row['STATION NAME']: (row, tmplate)
+                for (_, row), tmplate in zip(rows.iterrows(), templates)}
 
     def remove(self):
-        self.station_artist.figure.canvas.mpl_disconnect(self.cid)
-        self.cid = None
+        if self.cid is not None:
+            self.router.disconnect(self.cid)
+            self.cid = None
 
     def get_station_data(self, station_name, years):
         '''Get data from NOAA
@@ -141,8 +1212,34 @@ class StationPicker:
                                self.station_templates[station_name],
                                years)
 
+    def get_stations_data(self, years, stations=None, **kwargs):
+        '''Get data from NOAA for many stations at once
+
+        Parameters
+        ----------
+        years : list
+           List of years to get data for
+        stations : iterable of str, optional
+            Names of picked stations, defaults to all of them
+        **kwargs
+            Passed through to `get_multi_station_data`
+
+        Returns
+        -------
+        data : DataFrame
+            Indexed by (station, datetime)
+        failures : dict
+            Maps station name to ``{year: exception}``
+        '''
+        if stations is None:
+            stations = self.station_templates
+        templates = {name: self.station_templates[name]
+                     for name in stations}
+        return get_multi_station_data(self.data_path, templates, years,
+                                      **kwargs)
+
 
-def plot_station_locations(fig, fih, pick_radius=10):
+def plot_station_locations(fig, fih, pick_radius=10, natural_earth_dir=None):
     fig.clf()
     fig.add_subplot(1, 1, 1, projection=cartopy.crs.PlateCarree())
 
@@ -176,23 +1273,31 @@ def plot_station_locations(fig, fih, pick_radius=10):
     ax.set_xlim(-80.5, -71)
     ax.set_ylim(36, 45)
 
-    ax.add_feature(land)
-    ax.add_feature(lakes)
-    ax.add_feature(states_provinces, edgecolor='gray')
-    ax.add_feature(countries, edgecolor='gray')
-    art, = ax.plot('LON', 'LAT', 'o', data=fih, ms=5, picker=10)
+    # draw the features from cached tiles rather than re-projecting them
+    # on every draw
+    basemap = BasemapTiles(ax, [land, lakes, states_provinces, countries],
+                           name='natural_earth_50m',
+                           natural_earth_dir=natural_earth_dir)
+    # only draws the stations in view, and clusters them when zoomed out
+    layer = StationLayer(ax, fih['LON'], fih['LAT'], pick_radius=pick_radius)
+    art = layer.stations
 
     sp = StationPicker(art, fih)
 
-    return ax, art, sp
+    return ax, art, sp, layer, basemap
+
 
+if __name__ == '__main__':
+    data_path = os.path.expanduser('~/data_cache')
+    fih = get_filtered_isd(data_path)
+    fig = plt.figure()
+    ax, art, sp, layer, basemap = plot_station_locations(fig, fih)
 
-data_path = os.path.expanduser('~/data_cache')
-fih = get_filtered_isd(data_path)
-fig = plt.figure()
-ax, art, sp = plot_station_locations(fig, fih)
+    # after finding a station by picking on the map:
+    #
+    # mdw = sp.get_station_data('CHICAGO MIDWAY INTL ARPT', range(2015, 2019))
+    # mdw.to_hdf('data/mdw.h5')
 
-# after finding a station by picking on the map:
-#
-# mdw = sp.get_station_data('CHICAGO MIDWAY INTL ARPT', range(2015, 2019))
-# mdw.to_hdf('data/mdw.h5')
+    # to compare the vectorized parser to the line-by-line parser:
+    #
+    # benchmark_injest()
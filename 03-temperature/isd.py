@@ -0,0 +1,196 @@
+'''Parsing of ISD (Integrated Surface Database) records
+
+These live in a module (rather than in ``99-get_data.py``) so they can be
+sent to worker processes.
+'''
+import datetime
+import gzip
+import os
+
+import numpy as np
+import pandas as pd
+
+from w_helpers import (COMPACT_DTYPES, compact_dtypes, read_tagged,
+                       write_tagged)
+
+# characters in the mandatory section of a record, always present
+MANDATORY_WIDTH = 105
+# bytes to scan for the ends of records at a time
+SCAN_BYTES = 2**23
+
+
+def extract_date_time(row):
+    '''Extract the observation time from a single ISD record
+    '''
+    fmt_str = '%Y%m%d%H%M'
+    dt = datetime.datetime.strptime(row[15:27], fmt_str)
+    return dt, dt.year, dt.month, dt.day, dt.hour
+
+
+def extract_temperature(row):
+    t = int(row[87:92])
+    if t == 9999:
+        return (np.nan, )
+    return (t / 10,)
+
+
+def injest_file_by_line(fname):
+    '''Parse an ISD file one record at a time
+
+    This is the slow reference implementation, see `injest_file`.
+    '''
+    with gzip.open(fname, 'rt', encoding='ascii') as f:
+        data = [extract_date_time(ln) + extract_temperature(ln)
+                for ln in f]
+
+    return pd.DataFrame(data,
+                        columns=('datetime', 'year', 'month',
+                                 'day', 'hour', 'T')).dropna()
+
+
+def _record_starts(buf):
+    '''Offsets of the records in a buffer of ISD records
+
+    Records are variable length (the additional data section after the
+    mandatory one can be thousands of characters), so rather than
+    splitting the buffer we find where each record starts and read the
+    fixed-width columns of the mandatory section relative to that.
+    '''
+    # a block at a time so the comparison does not double the memory
+    ends = np.concatenate(
+        [np.flatnonzero(buf[i:i + SCAN_BYTES] == ord('\n')) + i
+         for i in range(0, len(buf), SCAN_BYTES)] or [np.zeros(0, int)])
+    if len(buf) and buf[-1] != ord('\n'):
+        # no newline after the last record
+        ends = np.append(ends, len(buf))
+    starts = np.concatenate([[0], ends[:-1] + 1])[:len(ends)]
+    short = np.flatnonzero(ends - starts < MANDATORY_WIDTH)
+    if len(short):
+        raise ValueError(f'record {short[0]} is shorter than the '
+                         f'{MANDATORY_WIDTH} character mandatory section')
+    return starts
+
+
+def _parse_digits(buf, starts, start, stop):
+    '''Convert the fixed-width digit column [start, stop) to integers
+    '''
+    digits = buf[starts[:, None] + np.arange(start, stop)].astype(np.int64)
+    digits -= ord('0')
+    bad = ((digits < 0) | (digits > 9)).any(axis=1)
+    if bad.any():
+        raise ValueError(f'record {np.flatnonzero(bad)[0]} has a non-digit '
+                         f'in columns [{start}, {stop})')
+    return digits @ (10 ** np.arange(stop - start - 1, -1, -1))
+
+
+def parse_isd_records(raw):
+    '''Parse a buffer of ISD records into the hourly temperature frame
+
+    Parameters
+    ----------
+    raw : bytes
+        The decompressed contents of a ``{USAF}-{WBAN}-{year}.gz`` file
+
+    Returns
+    -------
+    DataFrame
+        Same columns as `injest_file_by_line`
+    '''
+    buf = np.frombuffer(raw, dtype=np.uint8)
+    starts = _record_starts(buf)
+    # date / time lives in [15, 27) as YYYYMMDDHHMM
+    year = _parse_digits(buf, starts, 15, 19)
+    month = _parse_digits(buf, starts, 19, 21)
+    day = _parse_digits(buf, starts, 21, 23)
+    hour = _parse_digits(buf, starts, 23, 25)
+    minute = _parse_digits(buf, starts, 25, 27)
+    # build the datetime64 values directly rather than parsing strings
+    dt = ((year - 1970) * 12 + month - 1).astype('datetime64[M]')
+    dt = dt.astype('datetime64[D]') + (day - 1)
+    dt = dt.astype('datetime64[m]') + (hour * 60 + minute)
+    # temperature lives in [87, 92) as a sign + 4 digits in tenths of ℃
+    t = _parse_digits(buf, starts, 88, 92)
+    sign = buf[starts + 87]
+    bad = (sign != ord('+')) & (sign != ord('-'))
+    if bad.any():
+        raise ValueError(f'record {np.flatnonzero(bad)[0]} has no sign on '
+                         'its temperature')
+    T = np.where(t == 9999, np.nan, t / 10)
+    T[sign == ord('-')] *= -1
+
+    return pd.DataFrame({'datetime': dt.astype('datetime64[ns]'),
+                         'year': year,
+                         'month': month,
+                         'day': day,
+                         'hour': hour,
+                         'T': T},
+                        columns=('datetime', 'year', 'month',
+                                 'day', 'hour', 'T')).dropna()
+
+
+def injest_file(fname, compact=False):
+    with gzip.open(fname, 'rb') as f:
+        raw = f.read()
+    df = parse_isd_records(raw)
+    if compact:
+        df = compact_dtypes(df)
+    return df
+
+
+def parsed_cache_path(target_file, data_dir):
+    '''Where the parsed copy of a cached ISD file lives
+
+    ``{data_dir}/{year}/{template}`` is parsed into
+    ``{data_dir}/parsed/{year}/{template stem}.h5``
+    '''
+    rel = os.path.relpath(target_file, data_dir)
+    return os.path.join(data_dir, 'parsed',
+                        os.path.splitext(rel)[0] + '.h5')
+
+
+def injest_cached(target_file, parsed_file, source_sha256, compact=False):
+    '''Parse an ISD file, re-using a previously parsed copy if possible
+
+    The parsed copy is stored with compact dtypes (see
+    `w_helpers.COMPACT_DTYPES`) and tagged with the checksum of the file
+    it was parsed from.  It is only used if that matches
+    ``source_sha256``.
+
+    Parameters
+    ----------
+    target_file : str
+        The raw ISD file
+
+    parsed_file : str
+        The parsed copy
+
+    source_sha256 : str or None
+        The checksum of ``target_file`` (see `CacheIndex`).  If None, the
+        cache is bypassed.
+
+    compact : bool, optional
+        If True, return the compact schema rather than converting back
+
+    Returns
+    -------
+    DataFrame
+        Same as `injest_file`
+    '''
+    if source_sha256 is None:
+        return injest_file(target_file, compact=compact)
+
+    stored = read_tagged(parsed_file, ['hourly'], source_sha256=source_sha256)
+    if stored is not None:
+        df = stored['hourly']
+        if compact:
+            return df
+        # float32 -> float64 is not exact, but the raw data is in tenths
+        # of a degree so rounding recovers what we parsed
+        df['T'] = df['T'].astype('float64').round(1)
+        return df.astype({k: 'int64' for k in COMPACT_DTYPES if k != 'T'})
+
+    df = injest_file(target_file)
+    compact_df = compact_dtypes(df)
+    write_tagged(parsed_file, {'hourly': compact_df},
+                 source_sha256=source_sha256)
+    return compact_df if compact else df
@@ -1,8 +1,186 @@
-import datetime
+from collections import OrderedDict, deque
+import time
+import numpy as np
 import pandas as pd
 import os
 from pathlib import Path
 
+# opt-in compact schema for hourly data, see `compact_dtypes`
+COMPACT_DTYPES = {'year': 'uint16',
+                  'month': 'uint8',
+                  'day': 'uint8',
+                  'hour': 'uint8',
+                  'T': 'float32'}
+
+
+def compact_dtypes(df):
+    """Convert hourly data to the compact schema
+
+    Parameters
+    ----------
+    df : DataFrame
+       Hourly data, any of the columns {'year', 'month', 'day', 'hour', 'T'}
+       that are present are converted
+
+    Returns
+    -------
+    DataFrame
+       A copy of the data using `COMPACT_DTYPES`
+    """
+    return df.astype({k: v for k, v in COMPACT_DTYPES.items() if k in df})
+
+
+def _percentile_label(p):
+    # match the column names `describe` uses
+    return f'{100 * p:g}%'
+
+
+def _describe_frame(stats, quantiles, fields):
+    """Assemble the output of `aggregate` in the layout of `describe`
+    """
+    time = stats.index
+    if isinstance(time, pd.MultiIndex):
+        time = time.get_level_values(-1)
+    out = pd.DataFrame({f: getattr(time, f) for f in fields},
+                       index=stats.index)
+    out['count'] = stats['count']
+    out['mean'] = stats['mean']
+    out['std'] = stats['std']
+    out['min'] = stats['min']
+    for q in quantiles:
+        out[q] = quantiles[q]
+    out['max'] = stats['max']
+    return out
+
+
+def _roll_up(fine, freq):
+    """Combine per-group statistics into statistics of coarser groups
+
+    ``fine`` must have columns {'count', 'mean', 'm2', 'min', 'max'} where
+    'm2' is the sum of squared deviations from the mean.  Uses the
+    pair-wise update of Chan et al. so no raw data is needed.
+    """
+    if isinstance(fine.index, pd.MultiIndex):
+        # (group, period), roll up within each group
+        key = [fine.index.get_level_values(0),
+               fine.index.get_level_values(1).asfreq(freq)]
+        key_index = pd.MultiIndex.from_arrays(key)
+    else:
+        key = key_index = fine.index.asfreq(freq)
+    n = fine['count']
+    gb = pd.DataFrame({'count': n,
+                       'sum': fine['mean'] * n,
+                       'min': fine['min'],
+                       'max': fine['max']}).groupby(key)
+    coarse = gb.agg({'count': 'sum', 'sum': 'sum', 'min': 'min', 'max': 'max'})
+    coarse['mean'] = coarse['sum'] / coarse['count']
+    dev = fine['mean'].values - coarse['mean'].reindex(key_index).values
+    coarse['m2'] = (fine['m2'] + n * dev**2).groupby(key).sum()
+    return coarse.drop(columns='sum')
+
+
+def aggregate(df, col='T', percentiles=(.25, .5, .75), by=None):
+    """Given hourly data, compute statistics by day, month, and year
+
+    The count / mean / std / min / max of each day are computed from the
+    hourly data and then rolled up into months and years without going
+    back to the hourly data.  The percentiles are order statistics and
+    can not be rolled up, they are computed directly for each level.
+
+    Parameters
+    ----------
+    df : DataFrame
+       Must have a time index
+
+    col : str, optional
+       The column to aggregate.  Defaults to 'T'
+
+    percentiles : iterable of float, optional
+       The percentiles to include.  Defaults to the quartiles
+
+    by : array, optional
+       A group label for each row of ``df``.  If given, each group is
+       aggregated separately (but in the same pass) and the outputs are
+       indexed by (label, time).
+
+    Returns
+    -------
+    dict
+       Maps 'day', 'month', and 'year' to DataFrames.  Days are indexed
+       by midnight, months by the 15th and years by July 1st.  Each has
+       the columns of `describe` + 'year', 'month', and 'day' as
+       appropriate.
+    """
+    values = df[col].astype('float64')
+    percentiles = list(percentiles)
+    labels = [_percentile_label(p) for p in percentiles]
+
+    def key(freq):
+        periods = df.index.to_period(freq)
+        return periods if by is None else [by, periods]
+
+    def quantiles(freq):
+        q = values.groupby(key(freq)).quantile(percentiles).unstack()
+        q.columns = labels
+        return q
+
+    daily = values.groupby(key('D')).agg(
+        ['count', 'mean', 'std', 'min', 'max'])
+    daily['m2'] = (daily['std']**2 * (daily['count'] - 1)).fillna(0)
+    monthly = _roll_up(daily, 'M')
+    yearly = _roll_up(monthly, 'Y')
+
+    out = {}
+    for level, stats, freq, offset, fields in (
+            ('day', daily, 'D', pd.Timedelta(0), ('year', 'month', 'day')),
+            ('month', monthly, 'M', pd.Timedelta(days=14),
+             ('year', 'month')),
+            ('year', yearly, 'Y', pd.DateOffset(months=6), ('year',))):
+        stats['std'] = (stats['m2'] / (stats['count'] - 1)) ** .5
+        level_df = _describe_frame(stats, quantiles(freq), fields)
+        if by is None:
+            level_df.index = level_df.index.to_timestamp() + offset
+            level_df.index.name = None
+        else:
+            level_df.index = pd.MultiIndex.from_arrays(
+                [level_df.index.get_level_values(0),
+                 level_df.index.get_level_values(1).to_timestamp() + offset],
+                names=[None, None])
+        out[level] = level_df
+    return out
+
+
+def aggregate_many(frames, col='T'):
+    """Aggregate several hourly data sets in one pass
+
+    The data sets are stacked and handed to `aggregate` with a group
+    key, which is much faster than aggregating each one in turn.
+
+    Parameters
+    ----------
+    frames : dict
+       Maps label to hourly data with a time index
+
+    col : str, optional
+       The column to aggregate.  Defaults to 'T'
+
+    Returns
+    -------
+    dict
+       Maps label to the output of `aggregate`
+    """
+    labels = list(frames)
+    if not labels:
+        return {}
+    stacked = pd.concat([frames[k][[col]] for k in labels])
+    codes = np.repeat(np.arange(len(labels)),
+                      [len(frames[k]) for k in labels])
+    out = {k: {} for k in labels}
+    for level, level_df in aggregate(stacked, col, by=codes).items():
+        for code, group in level_df.groupby(level=0):
+            out[labels[code]][level] = group.droplevel(0)
+    return out
+
 
 def aggregate_by_month(df, col='T'):
     """Given a data frame of hourly data, compute statistics by month
@@ -10,7 +188,7 @@ def aggregate_by_month(df, col='T'):
     Parameters
     ----------
     df : DataFrame
-       Must have columns {'year', 'month'}
+       Must have a time index
 
     col : str, optional
        The column to aggregate.  Defaults to 'T'
@@ -21,11 +199,7 @@ def aggregate_by_month(df, col='T'):
        Indexed on the 15th of the month,
        Has columns of `describe` + 'year' and 'month'
     """
-    gb = df.groupby(('year', 'month'))[col].describe()
-    new_index = [datetime.date(*m, *(15, )) for m in gb.index]
-    gb.reset_index(inplace=True)
-    gb.index = new_index
-    return gb
+    return aggregate(df, col)['month']
 
 
 def aggregate_by_day(df, col='T'):
@@ -34,7 +208,7 @@ def aggregate_by_day(df, col='T'):
     Parameters
     ----------
     df : DataFrame
-       Must have columns {'year', 'month', 'day'}
+       Must have a time index
 
     col : str, optional
        The column to aggregate.  Defaults to 'T'
@@ -45,12 +219,15 @@ def aggregate_by_day(df, col='T'):
        Indexed by day.
        Has columns of `describe` + 'year', 'month', and 'day'
     """
+    return aggregate(df, col)['day']
+
 
-    gb = df.groupby(('year', 'month', 'day'))[col].describe()
-    new_index = [datetime.date(*m) for m in gb.index]
-    gb.reset_index(inplace=True)
-    gb.index = new_index
-    return gb
+def _sorted_by_time(df):
+    # `is_monotonic_increasing` is cached on the index, so this is only
+    # expensive the first time
+    if df.index.is_monotonic_increasing:
+        return df
+    return df.sort_index()
 
 
 def extract_month_of_daily(daily, year, month):
@@ -59,7 +236,7 @@ def extract_month_of_daily(daily, year, month):
     Parameters
     ----------
     daily : DataFrame
-        must of columns {'year', 'month'}
+        Must have a time index, as returned by `aggregate_by_day`
 
     year, month : int
         The year and month of interest
@@ -69,37 +246,598 @@ def extract_month_of_daily(daily, year, month):
 
     DataFrame
          Indexed on days from start of month.  Same columns as input
+         plus 'index' (the dates)
     """
-    ix = (daily['month'] == month) & (daily['year'] == year)
-    df = daily[ix]
-    idx = [(m - df.index[0]).days for m in df.index]
-    df.reset_index(inplace=True)
-    df.index = idx
+    daily = _sorted_by_time(daily)
+    start = pd.Timestamp(year, month, 1)
+    lo, hi = daily.index.searchsorted([start,
+                                       start + pd.DateOffset(months=1)])
+    df = daily.iloc[lo:hi].reset_index()
+    df.index = (df['index'] - df['index'].iloc[0]).dt.days.values
     return df
 
 
-def extract_day_of_hourly(hourly_df, year, month, day):
+def day_offsets(hourly_df):
+    """Compute where each day starts and stops in hourly data
+
+    Parameters
+    ----------
+    hourly_df : DataFrame
+      Must have a time index sorted in increasing order
+
+    Returns
+    -------
+    dict
+       Maps midnight of each day to the (start, stop) row positions of
+       that day.  Can be passed to `extract_day_of_hourly`
+    """
+    days = hourly_df.index.normalize()
+    if not len(days):
+        return {}
+    changes = np.flatnonzero(days[1:] != days[:-1]) + 1
+    starts = np.r_[0, changes]
+    stops = np.r_[changes, len(days)]
+    return dict(zip(days[starts], zip(starts, stops)))
+
+
+def extract_day_of_hourly(hourly_df, year, month, day, offsets=None):
     """Given a data frame with hourly data, extract data for year-month-day
 
     Parameters
     ----------
     hourly_df : DataFrame
-      Must have columns 'year', 'month', 'day' with the expected semantics and
-      a time index
+      Must have a time index
 
     year, month, day : int
         The day to extract the data for
-    """
 
-    ix = ((hourly_df['month'] == month) &
-          (hourly_df['year'] == year) &
-          (hourly_df['day'] == day))
-    df = hourly_df[ix]
-    midnight = datetime.datetime(year, month, day, 0, 0)
-    df.index = [(m - midnight).seconds / 3600 for m in df.index]
+    offsets : dict, optional
+        The output of `day_offsets` for ``hourly_df``.  If not given the
+        day is found by binary search on the index.
+
+    Returns
+    -------
+    DataFrame
+        Indexed on hours from midnight.  Same columns as input
+    """
+    midnight = pd.Timestamp(year, month, day)
+    if offsets is not None:
+        lo, hi = offsets.get(midnight, (0, 0))
+    else:
+        hourly_df = _sorted_by_time(hourly_df)
+        lo, hi = hourly_df.index.searchsorted(
+            [midnight, midnight + pd.Timedelta(days=1)])
+    df = hourly_df.iloc[lo:hi]
+    df.index = (df.index - midnight) / pd.Timedelta(hours=1)
     return df
 
 
+class SliceCache:
+    """Least-recently-used cache of extracted slices of data
+
+    Parameters
+    ----------
+    max_bytes : int, optional
+       Once the cached DataFrames use more memory than this, the least
+       recently used are evicted.  Defaults to 64MiB.
+
+    Attributes
+    ----------
+    hits, misses : int
+       Counts of lookups that were / were not already cached
+    nbytes : int
+       Memory used by the cached DataFrames
+    """
+    def __init__(self, max_bytes=64 * 2**20):
+        self.max_bytes = max_bytes
+        self._cache = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._cache)
+
+    def __repr__(self):
+        return (f'<SliceCache: {len(self)} entries, {self.nbytes} bytes, '
+                f'{self.hits} hits, {self.misses} misses>')
+
+    def get(self, key, compute):
+        """Look up ``key``, calling ``compute()`` to fill it in if needed
+
+        The returned DataFrame is shared, do not modify it.
+        """
+        try:
+            df, nbytes = self._cache[key]
+        except KeyError:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._cache.move_to_end(key)
+            return df
+
+        df = compute()
+        nbytes = int(df.memory_usage(deep=True).sum())
+        self._cache[key] = (df, nbytes)
+        self.nbytes += nbytes
+        # always keep the one we just added
+        while self.nbytes > self.max_bytes and len(self._cache) > 1:
+            _, (_, evicted) = self._cache.popitem(last=False)
+            self.nbytes -= evicted
+        return df
+
+    def invalidate(self, label=None):
+        """Drop cached slices
+
+        Parameters
+        ----------
+        label : str, optional
+           Only drop keys whose first element is ``label``, otherwise drop
+           everything
+        """
+        if label is None:
+            self._cache.clear()
+            self.nbytes = 0
+            return
+        for key in [k for k in self._cache if k[0] == label]:
+            _, nbytes = self._cache.pop(key)
+            self.nbytes -= nbytes
+
+
+def min_max_decimate(x, y, x0, x1, n_buckets):
+    """Pick the points needed to draw y(x) over [x0, x1] at a resolution
+
+    The range is split into ``n_buckets`` equal width buckets and from
+    each we keep the first, last, smallest and largest point.  Drawn
+    with a bucket per pixel, the result looks the same as the full data.
+
+    Parameters
+    ----------
+    x : array
+       Sorted in increasing order
+
+    y : array
+       Same length as x
+
+    x0, x1 : float
+       The visible range
+
+    n_buckets : int
+       Number of buckets (pixels) across the visible range
+
+    Returns
+    -------
+    array of int
+       Sorted positions into ``x`` and ``y``, including one point either
+       side of the visible range so lines run off the edge.
+    """
+    lo, hi = np.searchsorted(x, [x0, x1])
+    lo, hi = max(lo - 1, 0), min(hi + 1, len(x))
+    if hi - lo <= 4 * n_buckets:
+        return np.arange(lo, hi)
+
+    xs, ys = x[lo:hi], y[lo:hi]
+    bucket = np.clip((xs - x0) * (n_buckets / (x1 - x0)),
+                     -1, n_buckets).astype(int)
+    starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+    stops = np.r_[starts[1:], len(xs)]
+    seg = np.repeat(np.arange(len(starts)), stops - starts)
+
+    def first_per_segment(mask):
+        pos = np.flatnonzero(mask)
+        return pos[np.r_[True, seg[pos][1:] != seg[pos][:-1]]]
+
+    # fmin / fmax skip nan
+    mins = np.fmin.reduceat(ys, starts)[seg]
+    maxes = np.fmax.reduceat(ys, starts)[seg]
+    keep = np.concatenate([starts, stops - 1,
+                           first_per_segment(ys == mins),
+                           first_per_segment(ys == maxes)])
+    return np.unique(keep) + lo
+
+
+class DecimatedLine:
+    def __init__(self, ln, buckets_per_pixel=1):
+        '''Only hand a line the points needed at the current zoom level
+
+        The full data of ``ln`` is stashed and every time the x-limits of
+        its axes (or the size of the figure) change the line's data is
+        replaced by `min_max_decimate` of the visible range.  The line's
+        picker is wrapped so ``event.ind`` in pick events is still in
+        terms of the full data.
+
+        Parameters
+        ----------
+        ln : Line2D
+            Must already be in an Axes and have x sorted in increasing
+            order
+
+        buckets_per_pixel : float, optional
+            Resolution of the decimation
+        '''
+        self.ln = ln
+        self.ax = ax = ln.axes
+        # the data in (unit converted) floats
+        self.x = np.asarray(ln.get_xdata(orig=False), dtype=float)
+        self.y = np.asarray(ln.get_ydata(orig=False), dtype=float)
+        self.buckets_per_pixel = buckets_per_pixel
+        # positions in the full data of the points currently displayed
+        self.index = np.arange(len(self.x))
+
+        picker = ln.get_picker()
+        if picker is not None and picker is not False:
+            if picker is not True and not callable(picker):
+                ln.set_pickradius(picker)
+            ln.set_picker(self._pick)
+
+        self.cids = [ax.callbacks.connect('xlim_changed', self.update)]
+        self.canvas_cids = [ax.figure.canvas.mpl_connect('resize_event',
+                                                         self.update)]
+        self.update()
+
+    def update(self, *args):
+        x0, x1 = self.ax.get_xlim()
+        n_buckets = int(self.ax.bbox.width * self.buckets_per_pixel)
+        self.index = min_max_decimate(self.x, self.y, min(x0, x1),
+                                      max(x0, x1), max(n_buckets, 1))
+        self.ln.set_data(self.x[self.index], self.y[self.index])
+
+    def _pick(self, artist, mouseevent):
+        hit, props = artist.contains(mouseevent)
+        if hit:
+            props = dict(props, ind=self.index[props['ind']])
+        return hit, props
+
+    def remove(self):
+        '''Put the full data back and stop following the view limits
+        '''
+        for cid in self.cids:
+            self.ax.callbacks.disconnect(cid)
+        for cid in self.canvas_cids:
+            self.ax.figure.canvas.mpl_disconnect(cid)
+        self.cids = self.canvas_cids = []
+        self.ln.set_data(self.x, self.y)
+        self.index = np.arange(len(self.x))
+
+
+class EventRouter:
+    """Dispatch canvas events to handlers by (event type, axes, gid)
+
+    Each event type is connected to the canvas once, no matter how many
+    handlers there are.  For pick events the key is the axes and gid of
+    the picked artist, for all other events it is ``event.inaxes`` and
+    its gid.  Either may be registered as None to match anything, so an
+    event is looked up under at most 4 keys and dispatch does not get
+    slower as handlers are added.
+
+    Use `get_router` to share one router per canvas.
+
+    Parameters
+    ----------
+    canvas : FigureCanvas
+       The canvas to listen to
+
+    Attributes
+    ----------
+    monitor : LatencyMonitor or None
+       If set, handlers are called through it (see `LatencyMonitor.attach`)
+    """
+    def __init__(self, canvas):
+        self.canvas = canvas
+        # event type -> {(axes, gid): [handler, ...]}
+        self._handlers = {}
+        # event type -> canvas cid
+        self._cids = {}
+        self.monitor = None
+
+    def __len__(self):
+        return sum(len(handlers) for table in self._handlers.values()
+                   for handlers in table.values())
+
+    def __repr__(self):
+        return (f'<EventRouter: {len(self)} handlers on '
+                f'{sorted(self._cids)}>')
+
+    def connect(self, event_type, handler, ax=None, gid=None):
+        """Call ``handler(event)`` for matching events
+
+        Parameters
+        ----------
+        event_type : str
+           Any event `mpl_connect` accepts
+        handler : callable
+        ax : Axes, optional
+           Only events on this axes (the picked artist's for pick events)
+        gid : str, optional
+           Only events whose artist (pick events) or axes has this gid
+
+        Returns
+        -------
+        tuple
+           Pass to `disconnect` to remove the handler
+        """
+        if event_type not in self._cids:
+            self._handlers[event_type] = {}
+            self._cids[event_type] = self.canvas.mpl_connect(
+                event_type, self._dispatch)
+        key = (ax, gid)
+        self._handlers[event_type].setdefault(key, []).append(handler)
+        return (event_type, key, handler)
+
+    def disconnect(self, token):
+        """Remove a handler added by `connect`
+
+        Once no handlers are left for an event type the canvas callback
+        is removed as well.
+        """
+        event_type, key, handler = token
+        table = self._handlers.get(event_type, {})
+        handlers = table.get(key, [])
+        if handler in handlers:
+            handlers.remove(handler)
+        if not handlers:
+            table.pop(key, None)
+        if not table and event_type in self._cids:
+            self.canvas.mpl_disconnect(self._cids.pop(event_type))
+            del self._handlers[event_type]
+
+    def disconnect_all(self, tokens):
+        for token in tokens:
+            self.disconnect(token)
+
+    def remove(self):
+        """Drop every handler and canvas callback
+        """
+        for cid in self._cids.values():
+            self.canvas.mpl_disconnect(cid)
+        self._cids = {}
+        self._handlers = {}
+
+    def _dispatch(self, event):
+        table = self._handlers.get(event.name)
+        if not table:
+            return
+        if event.name == 'pick_event':
+            ax = event.artist.axes
+            gid = event.artist.get_gid()
+        else:
+            ax = getattr(event, 'inaxes', None)
+            gid = None if ax is None else ax.get_gid()
+        keys = [(ax, gid), (ax, None), (None, gid), (None, None)]
+        monitor = self.monitor
+        for key in OrderedDict.fromkeys(keys):
+            # copy, handlers may disconnect themselves
+            for handler in list(table.get(key, ())):
+                if monitor is None:
+                    handler(event)
+                else:
+                    monitor.call(handler, event)
+
+
+def get_router(canvas):
+    """The `EventRouter` shared by everything on ``canvas``
+
+    The router is kept on the canvas, so it (and every handler in it)
+    goes away with the figure.
+    """
+    router = getattr(canvas, '_event_router', None)
+    if router is None:
+        router = canvas._event_router = EventRouter(canvas)
+    return router
+
+
+def _handler_name(handler):
+    name = getattr(handler, '__qualname__', None)
+    if name is None:
+        # a callable object
+        name = type(handler).__qualname__
+    return name
+
+
+class LatencyMonitor:
+    """Measure how long event handlers and the redraws they cause take
+
+    For every handled event a record is kept of
+
+    - 'handler_ms': wall time spent in the handler
+    - 'draw_ms': time spent rendering the draw (or blit) that followed
+    - 'latency_ms': time from the handler starting (Matplotlib events do
+      not carry a timestamp) to that draw's 'draw_event' or the blit
+      finishing
+
+    Records go in a ring buffer, see `to_frame`, `to_csv`, `to_json` and
+    `summary`.  While enabled, ``canvas.draw`` and ``canvas.blit`` are
+    wrapped to time renders, including the ones `draw_idle` triggers.
+    Nothing is wrapped or connected while disabled, and a router without
+    a monitor attached does not check for one beyond a single `is None`.
+
+    Parameters
+    ----------
+    canvas : FigureCanvas
+       The canvas to watch
+    maxlen : int, optional
+       The number of records to keep
+
+    Attributes
+    ----------
+    records : deque
+       One dict per handled event, oldest first
+    renders : deque
+       (start, duration in ms) of every draw and blit
+    """
+    FIELDS = ('event', 'handler', 'start', 'handler_ms', 'draw_ms',
+              'latency_ms')
+
+    def __init__(self, canvas, maxlen=1000):
+        self.canvas = canvas
+        self.records = deque([], maxlen=maxlen)
+        self.renders = deque([], maxlen=maxlen)
+        self.enabled = False
+        self.overlay = None
+        # records waiting for the draw that shows their result
+        self._pending = []
+        self._draw_start = None
+        self._originals = {}
+        self._cid = None
+
+    def __repr__(self):
+        state = 'enabled' if self.enabled else 'disabled'
+        return f'<LatencyMonitor: {state}, {len(self.records)} records>'
+
+    def enable(self):
+        if self.enabled:
+            return
+        self.enabled = True
+        # shadow the bound methods on the instance, undone by `disable`
+        for name in ('draw', 'blit'):
+            method = getattr(self.canvas, name, None)
+            if method is not None:
+                self._originals[name] = method
+                setattr(self.canvas, name, self._timed(name, method))
+        self._cid = self.canvas.mpl_connect('draw_event', self._on_draw)
+
+    def disable(self):
+        if not self.enabled:
+            return
+        self.enabled = False
+        for name in self._originals:
+            delattr(self.canvas, name)
+        self._originals = {}
+        self.canvas.mpl_disconnect(self._cid)
+        self._cid = None
+        self._pending = []
+
+    def attach(self, router):
+        """Time every handler `router` dispatches to
+        """
+        router.monitor = self
+
+    def call(self, handler, event):
+        """Call ``handler(event)``, recording how long it takes
+        """
+        if not self.enabled:
+            return handler(event)
+        record = {'event': event.name,
+                  'handler': _handler_name(handler),
+                  'start': time.perf_counter(),
+                  'handler_ms': np.nan,
+                  'draw_ms': np.nan,
+                  'latency_ms': np.nan}
+        self.records.append(record)
+        # pending already, handlers may draw or blit before returning
+        self._pending.append(record)
+        try:
+            return handler(event)
+        finally:
+            record['handler_ms'] = (time.perf_counter() -
+                                    record['start']) * 1e3
+
+    def wrap(self, handler):
+        """Wrap a handler to pass to `mpl_connect` directly
+        """
+        def timed_handler(event):
+            return self.call(handler, event)
+        timed_handler.__qualname__ = _handler_name(handler)
+        return timed_handler
+
+    def _timed(self, name, method):
+        def timed(*args, **kwargs):
+            outer = self._draw_start is None
+            if outer:
+                self._draw_start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                if outer:
+                    # draws are finished off by their draw_event
+                    if name == 'blit':
+                        self._finish(self._draw_start)
+                    self._draw_start = None
+        return timed
+
+    def _finish(self, draw_start):
+        now = time.perf_counter()
+        if draw_start is None:
+            # not drawn through canvas.draw, e.g. savefig
+            draw_ms = np.nan
+        else:
+            draw_ms = (now - draw_start) * 1e3
+            self.renders.append((draw_start, draw_ms))
+        for record in self._pending:
+            record['draw_ms'] = draw_ms
+            record['latency_ms'] = (now - record['start']) * 1e3
+        self._pending = []
+
+    def _on_draw(self, event):
+        self._finish(self._draw_start)
+        # the figure is rendered but not yet shown, add the overlay
+        if self.overlay is not None:
+            self.overlay.set_text(self._overlay_text())
+            self.canvas.figure.draw_artist(self.overlay)
+
+    def _overlay_text(self, n=100):
+        recent = list(self.records)[-n:]
+        if not recent:
+            return 'no events yet'
+        by_handler = {}
+        for record in recent:
+            by_handler.setdefault(record['handler'], []).append(record)
+        lines = []
+        for name, records in by_handler.items():
+            handler_ms = np.array([r['handler_ms'] for r in records])
+            latency_ms = np.array([r['latency_ms'] for r in records])
+            latency_ms = latency_ms[np.isfinite(latency_ms)]
+            latency = (f'{np.median(latency_ms):.1f}'
+                       if len(latency_ms) else '-')
+            lines.append(f'{name}: {len(records)}x '
+                         f'{np.median(handler_ms):.1f} ms, '
+                         f'to screen {latency} ms')
+        return '\n'.join(lines)
+
+    def show_overlay(self, show=True):
+        """Show a summary of recent events in the corner of the figure
+        """
+        if show and self.overlay is None:
+            self.overlay = self.canvas.figure.text(
+                .01, .01, '', animated=True, family='monospace',
+                fontsize='x-small', va='bottom',
+                bbox={'facecolor': 'w', 'alpha': .7})
+        elif not show and self.overlay is not None:
+            self.overlay.remove()
+            self.overlay = None
+        if self.enabled:
+            self.canvas.draw_idle()
+
+    def clear(self):
+        self.records.clear()
+        self.renders.clear()
+        self._pending = []
+
+    def to_frame(self):
+        return pd.DataFrame(list(self.records), columns=self.FIELDS)
+
+    def to_csv(self, fname):
+        self.to_frame().to_csv(fname, index=False)
+
+    def to_json(self, fname):
+        self.to_frame().to_json(fname, orient='records')
+
+    def summary(self):
+        """Statistics of the recorded times, by event type and handler
+
+        Returns
+        -------
+        DataFrame
+           count / median / 95th percentile / max of each time
+        """
+        df = self.to_frame()
+        gb = df.groupby(['event', 'handler'])[
+            ['handler_ms', 'draw_ms', 'latency_ms']]
+        out = gb.agg(['count', 'median',
+                      lambda x: x.quantile(.95), 'max'])
+        return out.rename(columns={'<lambda_0>': 'p95'}, level=1)
+
+
 def label_date(ax, label, date, df):
     '''Helper function to annotate a date
 
@@ -128,26 +866,239 @@ def label_date(ax, label, date, df):
                        arrowprops={'arrowstyle': '->'})
 
 
-def load_data(dataset):
+def _data_dir():
+    return Path(os.path.dirname(os.path.realpath(__file__))) / 'data'
+
+
+def _dataset_file(dataset):
+    p = _data_dir()
+    fname = p / f'{dataset}.h5'
+    if not fname.is_file():
+        sources = {f.stem for f in p.iterdir() if
+                   f.is_file() and f.name.endswith('h5')}
+        raise RuntimeError(f"Could not not find {dataset!r}.  Existing "
+                           f"datasets are {sources}")
+    return fname
+
+
+def load_data(dataset, start=None, end=None, columns=None, compact=False):
     """Load data from a given dataset
 
+    If the dataset is stored in table format (see `convert_to_table`) the
+    date range and column selection are done by PyTables as the data is
+    read, otherwise the whole file is read and then sliced.
+
     Parameters
     ----------
     dataset : str
        Searches from dataset.h5 in this file's directory
 
+    start, end : datetime-like, optional
+       Only load data in the range [start, end)
+
+    columns : list of str, optional
+       Only load these columns
+
+    compact : bool, optional
+       If True, convert to the compact schema (see `compact_dtypes`)
+
     Returns
     -------
     DataFrame
        Hourly temperature data
     """
-    p = Path(os.path.dirname(os.path.realpath(__file__))) / 'data'
-    fname = p / f'{dataset}.h5'
+    fname = _dataset_file(dataset)
+
+    where = []
+    if start is not None:
+        start = pd.Timestamp(start)
+        where.append('index >= start')
+    if end is not None:
+        end = pd.Timestamp(end)
+        where.append('index < end')
+
+    with pd.HDFStore(str(fname), 'r') as store:
+        key, = store.keys()
+        if store.get_storer(key).is_table:
+            df = store.select(key, where=where or None, columns=columns)
+        else:
+            df = store.select(key)
+            if start is not None:
+                df = df[df.index >= start]
+            if end is not None:
+                df = df[df.index < end]
+            if columns is not None:
+                df = df[columns]
+    if compact:
+        df = compact_dtypes(df)
+    return df
+
 
+def read_tagged(fname, keys, **tags):
+    """Read frames from an HDF5 file written by `write_tagged`
+
+    The tags are checked before any of the frames are read.
+
+    Parameters
+    ----------
+    fname : str or Path
+       The file to read
+
+    keys : sequence of str
+       The frames to read, the tags are stored on the first
+
+    **tags
+       The expected value of each tag
+
+    Returns
+    -------
+    dict or None
+       Maps key to DataFrame, or None if the file is missing, unreadable
+       or any of the tags do not match
+    """
     try:
-        return pd.read_hdf(str(fname))
-    except FileNotFoundError:
-        sources = {f.stem for f in p.iterdir() if
-                   f.is_file() and f.name.endswith('h5')}
-        raise RuntimeError(f"Could not not find {dataset!r}.  Existing "
-                           f"datasets are {sources}")
+        with pd.HDFStore(str(fname), 'r') as store:
+            attrs = store.get_storer(keys[0]).attrs
+            if all(getattr(attrs, k) == v for k, v in tags.items()):
+                return {k: store[k] for k in keys}
+    except (OSError, KeyError, AttributeError):
+        # missing, unreadable, or not written by us
+        pass
+    return None
+
+
+def write_tagged(fname, frames, format=None, **tags):
+    """Write frames to an HDF5 file tagged with where they came from
+
+    The file is written next to `fname` and then renamed over it so
+    readers never see a half written file.
+
+    Parameters
+    ----------
+    fname : str or Path
+       The file to write
+
+    frames : dict
+       Maps key to DataFrame, the tags are stored on the first
+
+    format : {'fixed', 'table'}, optional
+       Passed to `pandas.HDFStore.put`
+
+    **tags
+       Stored as attributes, see `read_tagged`
+    """
+    fname = Path(fname)
+    fname.parent.mkdir(parents=True, exist_ok=True)
+    tmp = str(fname) + '.tmp'
+    with pd.HDFStore(tmp, 'w') as store:
+        for k, df in frames.items():
+            store.put(k, df, format=format)
+        attrs = store.get_storer(next(iter(frames))).attrs
+        for k, v in tags.items():
+            setattr(attrs, k, v)
+    os.replace(tmp, str(fname))
+
+
+_LEVELS = ('day', 'month', 'year')
+
+
+def _pyramid_file(dataset):
+    return _data_dir() / 'pyramid' / f'{dataset}.h5'
+
+
+def load_aggregates(dataset, rebuild=False):
+    """Load the pre-computed aggregates of a dataset
+
+    The output of `aggregate` is stored in ``data/pyramid/{dataset}.h5``
+    along with the size and modification time of the dataset.  It is
+    (re)computed if it is missing or the dataset has changed.
+
+    Parameters
+    ----------
+    dataset : str
+       The name of the dataset
+
+    rebuild : bool, optional
+       If True, recompute even if the stored aggregates are up to date
+
+    Returns
+    -------
+    dict
+       Same as `aggregate`
+    """
+    source = _source_tag(dataset)
+    fname = _pyramid_file(dataset)
+    if not rebuild:
+        agg = read_tagged(fname, _LEVELS, source=source)
+        if agg is not None:
+            return agg
+    agg = aggregate(load_data(dataset))
+    write_tagged(fname, {k: agg[k] for k in _LEVELS}, source=source)
+    return agg
+
+
+def _source_tag(dataset):
+    stat = _dataset_file(dataset).stat()
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def convert_to_table(dataset=None):
+    """Rewrite a dataset in (indexed) table format
+
+    This only needs to be done once per file and lets `load_data` read
+    just the requested date range / columns.
+
+    Parameters
+    ----------
+    dataset : str, optional
+       The dataset to convert.  If not given, convert every dataset.
+    """
+    if dataset is None:
+        for f in _data_dir().iterdir():
+            if f.is_file() and f.name.endswith('h5'):
+                convert_to_table(f.stem)
+        return
+
+    fname = _dataset_file(dataset)
+    with pd.HDFStore(str(fname), 'r') as store:
+        key, = store.keys()
+        if store.get_storer(key).is_table:
+            return
+        df = store.select(key)
+
+    tmp = fname.with_suffix('.h5.tmp')
+    with pd.HDFStore(str(tmp), 'w', complevel=9, complib='blosc') as store:
+        store.put(key, df.sort_index(), format='table')
+        store.create_table_index(key, columns=['index'], optlevel=9,
+                                 kind='full')
+    os.replace(str(tmp), str(fname))
+
+
+def memory_report(datasets=('mdw', 'bwi', 'central_park')):
+    """Compare the memory used by the default and compact schemas
+
+    Parameters
+    ----------
+    datasets : iterable of str
+       The datasets to load
+
+    Returns
+    -------
+    DataFrame
+       Rows and bytes used (including the index) with each schema,
+       indexed by dataset
+    """
+    report = []
+    for dataset in datasets:
+        df = load_data(dataset)
+        default = df.memory_usage(deep=True).sum()
+        compact = compact_dtypes(df).memory_usage(deep=True).sum()
+        report.append({'dataset': dataset,
+                       'rows': len(df),
+                       'default': default,
+                       'compact': compact,
+                       'bytes/row (default)': default / len(df),
+                       'bytes/row (compact)': compact / len(df)})
+    report = pd.DataFrame(report).set_index('dataset')
+    report['ratio'] = report['compact'] / report['default']
+    return report
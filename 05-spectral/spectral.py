@@ -1,3 +1,7 @@
+from collections import OrderedDict
+import os
+import time
+
 import matplotlib.pyplot as plt
 from mpl_toolkits.axes_grid1 import make_axes_locatable
 from matplotlib.widgets import SpanSelector
@@ -5,12 +9,500 @@ from matplotlib.colors import LogNorm
 import numpy as np
 import h5py
 
+# how much of the spectrum to read at a time when streaming
+CHUNK_BYTES = 2**23
+# where summaries go if they can not be kept next to the spectrum
+SUMMARY_CACHE = os.path.expanduser('~/data_cache/spectral')
+
+
+def integrate_to_angles(spectrum, bins, lo, hi):
+    lo_ind, hi_ind = bins.searchsorted([lo, hi])
+    return spectrum[lo_ind:hi_ind].sum(axis=0)
+
+
+def row_step(spectrum, chunk_bytes=CHUNK_BYTES):
+    '''Number of energy rows `row_chunks` reads at a time
+
+    About `chunk_bytes` worth, rounded to a whole number of chunks for a
+    chunked HDF5 dataset so no chunk is read (and decompressed) twice.
+    '''
+    row_bytes = spectrum.dtype.itemsize * int(np.prod(spectrum.shape[1:]))
+    align = (getattr(spectrum, 'chunks', None) or (1,))[0]
+    return max(chunk_bytes // max(row_bytes, 1) // align, 1) * align
+
+
+def row_chunks(spectrum, chunk_bytes=CHUNK_BYTES):
+    '''Slices of energy rows to read the spectrum in, see `row_step`
+    '''
+    n_rows = spectrum.shape[0]
+    step = row_step(spectrum, chunk_bytes)
+    for start in range(0, n_rows, step):
+        yield slice(start, min(start + step, n_rows))
+
+
+def cumulative_spectrum(spectrum, out=None):
+    '''Running total of the spectrum along the energy axis
+
+    Row ``i`` is the sum of the first ``i`` energy bins, so the table has
+    one more row than the spectrum and the first row is 0.  Accumulated
+    in float64 so the differences of large totals stay exact.
+
+    Parameters
+    ----------
+    spectrum : array, np.memmap or h5py.Dataset
+        Read a block of rows at a time, see `row_chunks`
+
+    out : array or h5py.Dataset, optional
+        Where to write the table, by default a new array
+    '''
+    if out is None:
+        out = np.zeros((spectrum.shape[0] + 1,) + spectrum.shape[1:],
+                       dtype=np.float64)
+    out[0] = 0
+    carry = np.zeros(spectrum.shape[1:], dtype=np.float64)
+    for rows in row_chunks(spectrum):
+        block = np.cumsum(spectrum[rows], axis=0, dtype=np.float64)
+        block += carry
+        out[rows.start + 1:rows.stop + 1] = block
+        carry = block[-1]
+    return out
+
+
+def integrate_band(cumulative, bins, lo, hi):
+    '''Same as `integrate_to_angles` from the `cumulative_spectrum` table
+
+    Costs one subtraction per channel however wide [lo, hi] is.
+    '''
+    lo_ind, hi_ind = np.clip(bins.searchsorted([lo, hi]),
+                             0, len(cumulative) - 1)
+    if hi_ind <= lo_ind:
+        return np.zeros_like(cumulative[0])
+    return cumulative[hi_ind] - cumulative[lo_ind]
+
+
+def block_mean(block, factor):
+    '''Average each `factor` rows of ``block``, the last may be short
+    '''
+    full = len(block) // factor * factor
+    out = np.empty((-(-len(block) // factor),) + block.shape[1:],
+                   dtype=np.float32)
+    out[:full // factor] = block[:full].reshape(
+        (-1, factor) + block.shape[1:]).mean(axis=1)
+    if full < len(block):
+        out[-1] = block[full:].mean(axis=0)
+    return out
+
+
+class _RowMeans:
+    def __init__(self, out, factor):
+        '''Average each `factor` rows of a stream of blocks into `out`
+
+        The same as `block_mean` of all of the blocks stacked together,
+        the rows left over at the end of a block are carried into the
+        next one so the blocks can be any height.
+        '''
+        self.out = out
+        self.factor = factor
+        self.filled = 0
+        self._leftover = None
+
+    def add(self, block):
+        if self._leftover is not None:
+            take = self.factor - len(self._leftover)
+            self._leftover = np.concatenate([self._leftover, block[:take]])
+            block = block[take:]
+            if len(self._leftover) < self.factor:
+                return
+            self._write(self._leftover)
+            self._leftover = None
+        full = len(block) // self.factor * self.factor
+        self._write(block[:full])
+        if full < len(block):
+            # a copy, so the rest of the block can be freed
+            self._leftover = np.array(block[full:])
+
+    def finish(self):
+        if self._leftover is not None:
+            self._write(self._leftover)
+            self._leftover = None
+
+    def _write(self, block):
+        if len(block):
+            reduced = block_mean(block, self.factor)
+            self.out[self.filled:self.filled + len(reduced)] = reduced
+            self.filled += len(reduced)
+
+
+def _summarize(spectrum, cumulative, channel_cumulative, base, base_factor):
+    # one pass over the spectrum: fill in the cumulative tables and the
+    # base of the image pyramid, compute the energy marginal and range
+    n_rows = spectrum.shape[0]
+    energy_total = np.zeros(n_rows, dtype=np.float64)
+    vmin, vmax = np.inf, -np.inf
+    cumulative[0] = 0
+    channel_cumulative[0] = 0
+    carry = np.zeros(spectrum.shape[1:], dtype=np.float64)
+    base_rows = _RowMeans(base, base_factor)
+    for rows in row_chunks(spectrum):
+        block = np.asarray(spectrum[rows], dtype=np.float64)
+        energy_total[rows] = block.sum(axis=1)
+        positive = block[block > 0]
+        if positive.size:
+            vmin = min(vmin, positive.min())
+            vmax = max(vmax, positive.max())
+        base_rows.add(block)
+        channel_cumulative[1:, rows] = np.cumsum(block, axis=1).T
+        np.cumsum(block, axis=0, out=block)
+        block += carry
+        cumulative[rows.start + 1:rows.stop + 1] = block
+        carry = block[-1]
+    base_rows.finish()
+    return {'cumulative': cumulative,
+            'channel_cumulative': channel_cumulative,
+            'energy_total': energy_total,
+            'channel_total': carry,
+            'range': np.array([vmin, vmax])}
+
+
+def _build_levels(base, new_level, tile_rows):
+    # halve the height until one tile covers a whole level
+    levels = [base]
+    while len(levels[-1]) > tile_rows:
+        prev = levels[-1]
+        level = _RowMeans(new_level(-(-len(prev) // 2)), 2)
+        for rows in row_chunks(prev):
+            level.add(prev[rows])
+        level.finish()
+        levels.append(level.out)
+    return levels
+
+
+def summary_path(spectrum, summary_dir=None):
+    '''Where `load_summary` keeps the tables for an on-disk spectrum
+
+    In `summary_dir` if given, otherwise next to the spectrum, or in
+    `SUMMARY_CACHE` if that directory is not writable.
+    '''
+    if isinstance(spectrum, h5py.Dataset):
+        fname = spectrum.file.filename
+    else:
+        fname = spectrum.filename
+    if summary_dir is None:
+        summary_dir = os.path.dirname(os.path.abspath(fname))
+        if not os.access(summary_dir, os.W_OK):
+            summary_dir = SUMMARY_CACHE
+    stem = os.path.splitext(os.path.basename(fname))[0]
+    return os.path.join(summary_dir, stem + '.summary.h5')
+
+
+def load_summary(spectrum, base_factor=16, tile_rows=256,
+                 summary_dir=None):
+    '''The tables `plot_all_chan_spectrum` needs, without loading it all
+
+    Returns the cumulative table along energy (see
+    `cumulative_spectrum`) and one along the channels, stored transposed
+    so a channel band is the difference of two rows, the totals along
+    each axis, the range of positive values, and the stored levels of an
+    image pyramid (see `SpectrumPyramid`).  Pyramid level ``k`` averages
+    ``base_factor * 2**k`` energy rows.
+
+    An h5py dataset or `np.memmap` is read in chunks (see `row_chunks`)
+    and the tables are kept next to it (see `summary_path`), so only the
+    first call reads the whole file and memory use does not grow with
+    its size.  The cumulative tables and pyramid levels are returned as
+    h5py datasets and read a few rows at a time.
+
+    Parameters
+    ----------
+    spectrum : array, np.memmap or h5py.Dataset
+        Energy along the first axis
+
+    base_factor : int, optional
+        Rows averaged in the finest stored pyramid level, finer levels
+        are computed from `spectrum` as needed
+
+    tile_rows : int, optional
+        Height of the pyramid tiles, the coarsest level fits in one
+
+    summary_dir : str, optional
+        Where to keep the tables, see `summary_path`
+
+    Returns
+    -------
+    dict
+        With keys 'cumulative', 'channel_cumulative', 'energy_total',
+        'channel_total', 'range', 'levels', 'base_factor' and 'file', the
+        open `h5py.File` the tables live in (None if they are in memory).
+        Close it once the tables are no longer needed.
+    '''
+    shape = (spectrum.shape[0] + 1,) + spectrum.shape[1:]
+    channel_shape = (spectrum.shape[1] + 1, spectrum.shape[0])
+    base_shape = (-(-spectrum.shape[0] // base_factor),) + spectrum.shape[1:]
+    if not isinstance(spectrum, (h5py.Dataset, np.memmap)):
+        base = np.empty(base_shape, dtype=np.float32)
+        summary = _summarize(spectrum, np.zeros(shape),
+                             np.zeros(channel_shape), base, base_factor)
+        summary['levels'] = _build_levels(
+            base, lambda n: np.empty((n,) + base_shape[1:], np.float32),
+            tile_rows)
+        summary['base_factor'] = base_factor
+        summary['file'] = None
+        return summary
+
+    if isinstance(spectrum, h5py.Dataset):
+        source, key = spectrum.file.filename, spectrum.name.strip('/')
+    else:
+        source, key = spectrum.filename, 'memmap'
+    stat = os.stat(source)
+    tag = {'shape': spectrum.shape, 'size': stat.st_size,
+           'mtime_ns': stat.st_mtime_ns, 'base_factor': base_factor,
+           'tile_rows': tile_rows}
+
+    fname = summary_path(spectrum, summary_dir)
+    os.makedirs(os.path.dirname(fname), exist_ok=True)
+    fout = h5py.File(fname, 'a')
+    group = fout.get(key)
+    if (group is not None and 'channel_cumulative' in group and
+            all(np.array_equal(group.attrs.get(k), v)
+                for k, v in tag.items())):
+        summary = {k: group[k][:]
+                   for k in ('energy_total', 'channel_total', 'range')}
+        summary['cumulative'] = group['cumulative']
+        summary['channel_cumulative'] = group['channel_cumulative']
+        summary['levels'] = [group['levels'][k]
+                             for k in sorted(group['levels'], key=int)]
+        summary['base_factor'] = base_factor
+        summary['file'] = fout
+        return summary
+    if group is not None:
+        del fout[key]
+    group = fout.create_group(key)
+    cumulative = group.create_dataset(
+        'cumulative', shape, dtype=np.float64,
+        chunks=(min(16, shape[0]),) + shape[1:])
+    # chunked like the blocks `_summarize` writes, so each is written
+    # in whole chunks
+    channel_cumulative = group.create_dataset(
+        'channel_cumulative', channel_shape, dtype=np.float64,
+        chunks=(1, min(row_step(spectrum), channel_shape[1])))
+    levels = group.create_group('levels')
+
+    def new_level(n):
+        return levels.create_dataset(
+            str(len(levels)), (n,) + base_shape[1:], dtype=np.float32,
+            chunks=(min(tile_rows, n),) + base_shape[1:])
+
+    base = new_level(base_shape[0])
+    summary = _summarize(spectrum, cumulative, channel_cumulative, base,
+                         base_factor)
+    summary['levels'] = _build_levels(base, new_level, tile_rows)
+    summary['base_factor'] = base_factor
+    summary['file'] = fout
+    for k in ('energy_total', 'channel_total', 'range'):
+        group[k] = summary[k]
+    # mark complete last, an interrupted run is recomputed
+    group.attrs.update(tag)
+    fout.flush()
+    return summary
+
+
+class SpectrumPyramid:
+    def __init__(self, ax, spectrum, summary, extent, *, cmap=None,
+                 tile_rows=256, max_tiles=256):
+        '''Show a spectrum from a mipmap pyramid of log-normalized tiles
+
+        Each level of the pyramid averages twice as many energy rows as
+        the one below it.  On every zoom / pan / resize the coarsest level
+        with at least one row per screen pixel is picked and the tiles
+        covering the view are put together into one RGBA image.  Tiles
+        are normalized (with a fixed `LogNorm`) and colormapped once and
+        kept in a least-recently-used cache, so redraws neither
+        re-normalize nor resample the full spectrum.
+
+        Parameters
+        ----------
+        ax : Axes
+            The axes to draw in
+
+        spectrum : array, np.memmap or h5py.Dataset
+            Energy along the first axis, used for the levels finer than
+            those in `summary`
+
+        summary : dict
+            From `load_summary`
+
+        extent : tuple
+            (left, right, bottom, top) as for `imshow`
+
+        cmap : str or Colormap, optional
+
+        tile_rows : int, optional
+            Height of a tile, in rows of its level
+
+        max_tiles : int, optional
+            Number of rendered tiles to keep
+        '''
+        self.ax = ax
+        self.spectrum = spectrum
+        self.extent = extent
+        self.tile_rows = tile_rows
+        self.max_tiles = max_tiles
+        self.n_rows = spectrum.shape[0]
+        # (factor, source of rows), finest first
+        self.levels = [(2**k, None)
+                       for k in range(int(np.log2(summary['base_factor'])))]
+        self.levels += [(summary['base_factor'] * 2**k, level)
+                        for k, level in enumerate(summary['levels'])]
+        vmin, vmax = summary['range']
+        self.norm = LogNorm(vmin, vmax)
+        self.mappable = plt.cm.ScalarMappable(self.norm, cmap)
+        self._tiles = OrderedDict()
+        # (level, first tile, last tile) currently shown
+        self._shown = None
+        self.im = ax.imshow(np.zeros((1, 1, 4), dtype=np.uint8),
+                            origin='lower', aspect='auto', extent=extent)
+        ax.set_autoscale_on(False)
+        self.cids = [ax.callbacks.connect('xlim_changed', self.update),
+                     ax.callbacks.connect('ylim_changed', self.update)]
+        self.canvas_cids = [ax.figure.canvas.mpl_connect('resize_event',
+                                                         self.update)]
+        self.update()
+
+    def _rows(self, level, start, stop):
+        factor, source = self.levels[level]
+        if source is not None:
+            return np.asarray(source[start:stop])
+        # finer than stored, average the raw rows
+        block = np.asarray(self.spectrum[start * factor:
+                                         min(stop * factor, self.n_rows)],
+                           dtype=np.float64)
+        return block_mean(block, factor)
+
+    def tile(self, level, i):
+        '''RGBA of tile `i` of `level`
+        '''
+        key = (level, i)
+        try:
+            self._tiles.move_to_end(key)
+            return self._tiles[key]
+        except KeyError:
+            pass
+        data = self._rows(level, i * self.tile_rows,
+                          (i + 1) * self.tile_rows)
+        rgba = self.mappable.to_rgba(np.ma.masked_less_equal(data, 0),
+                                     bytes=True)
+        self._tiles[key] = rgba
+        while len(self._tiles) > self.max_tiles:
+            self._tiles.popitem(last=False)
+        return rgba
+
+    def pick_level(self):
+        y0, y1 = sorted(self.ax.get_ylim())
+        bottom, top = self.extent[2:]
+        rows_per_unit = self.n_rows / (top - bottom)
+        visible = (min(y1, top) - max(y0, bottom)) * rows_per_unit
+        wanted = max(visible, 1) / max(self.ax.bbox.height, 1)
+        level = 0
+        while (level + 1 < len(self.levels) and
+               self.levels[level + 1][0] <= wanted):
+            level += 1
+        r0 = max((y0 - bottom) * rows_per_unit, 0)
+        r1 = min((y1 - bottom) * rows_per_unit, self.n_rows)
+        return level, r0, r1
+
+    def update(self, *args):
+        level, r0, r1 = self.pick_level()
+        if r1 <= 0 or r0 >= self.n_rows:
+            # the view does not overlap the data
+            self.im.set_visible(False)
+            return
+        self.im.set_visible(True)
+        factor = self.levels[level][0]
+        span = factor * self.tile_rows
+        n_tiles = -(-self.n_rows // span)
+        first = min(int(r0 // span), n_tiles - 1)
+        last = min(max(int(np.ceil(r1 / span)), first + 1), n_tiles)
+        if self._shown == (level, first, last):
+            return
+        self._shown = (level, first, last)
+        rgba = np.concatenate([self.tile(level, i)
+                               for i in range(first, last)])
+        bottom, top = self.extent[2:]
+        units_per_row = (top - bottom) / self.n_rows
+        self.im.set_data(rgba)
+        # the last tile may be short
+        stop = min(first * span + len(rgba) * factor, self.n_rows)
+        self.im.set_extent((self.extent[0], self.extent[1],
+                            bottom + first * span * units_per_row,
+                            bottom + stop * units_per_row))
+
+    def remove(self):
+        for cid in self.cids:
+            self.ax.callbacks.disconnect(cid)
+        for cid in self.canvas_cids:
+            self.ax.figure.canvas.mpl_disconnect(cid)
+        self.cids = self.canvas_cids = []
+        self.im.remove()
+        self._tiles.clear()
+
+
+def benchmark_band_update(spectrum, bins, fractions=(.01, .1, .5, 1),
+                          repeat=50):
+    '''Time integrating a band, by slicing and from the cumulative table
 
-def plot_all_chan_spectrum(spectrum, bins, *, ax=None, **kwargs):
+    Parameters
+    ----------
+    spectrum, bins : array
+        As passed to `plot_all_chan_spectrum`
 
-    def integrate_to_angles(spectrum, bins, lo, hi):
-        lo_ind, hi_ind = bins.searchsorted([lo, hi])
-        return spectrum[lo_ind:hi_ind].sum(axis=0)
+    fractions : iterable of float
+        Band widths to try, as a fraction of the energy range
+
+    repeat : int, optional
+        Number of times to integrate each band, the fastest is reported
+
+    Returns
+    -------
+    list of dict
+        Band width and best time [ms] for each method
+    '''
+    def best_of(func):
+        times = []
+        for j in range(repeat):
+            start = time.perf_counter()
+            ret = func()
+            times.append(time.perf_counter() - start)
+        return min(times) * 1e3, ret
+
+    start = time.perf_counter()
+    cumulative = cumulative_spectrum(spectrum)
+    setup = (time.perf_counter() - start) * 1e3
+
+    results = []
+    for frac in fractions:
+        lo = bins[0]
+        hi = bins[0] + frac * (bins[-1] - bins[0])
+        sliced, expected = best_of(
+            lambda: integrate_to_angles(spectrum, bins, lo, hi))
+        table, actual = best_of(
+            lambda: integrate_band(cumulative, bins, lo, hi))
+        assert np.allclose(actual, expected)
+        results.append({'fraction': frac,
+                        'bins': int(np.searchsorted(bins, hi)),
+                        'slice [ms]': sliced,
+                        'cumulative [ms]': table,
+                        'table setup [ms]': setup})
+    return results
+
+
+def plot_all_chan_spectrum(spectrum, bins, *, ax=None, summary_dir=None,
+                           **kwargs):
+    # computed once, makes every span update O(channels) / O(energies)
+    summary = load_summary(spectrum, summary_dir=summary_dir)
+    cumulative = summary['cumulative']
+    channel_cumulative = summary['channel_cumulative']
+    # picks the channels lo <= c < hi
+    channel_bins = np.arange(spectrum.shape[1] + 1)
 
     if ax is None:
         fig, ax = plt.subplots(figsize=(13.5, 9.5))
@@ -26,30 +518,113 @@ def plot_all_chan_spectrum(spectrum, bins, *, ax=None, **kwargs):
     ax_t.xaxis.tick_top()
     ax_t.xaxis.set_label_position("top")
 
-    im = ax.imshow(spectrum, origin='lower', aspect='auto',
-                   extent=(-.5, 383.5,
-                           bins[0], bins[-1]),
-                   norm=LogNorm())
+    pyramid = SpectrumPyramid(ax, spectrum, summary,
+                              extent=(-.5, 383.5, bins[0], bins[-1]))
 
-    e_line, = ax_r.plot(spectrum.sum(axis=1), bins[:-1] + np.diff(bins))
-    p_line, = ax_t.plot(spectrum.sum(axis=0))
+    e_line, = ax_r.plot(summary['energy_total'], bins[:-1] + np.diff(bins))
+    p_line, = ax_t.plot(summary['channel_total'])
     label = ax_t.annotate('[0, 70] kEv', (0, 1), (10, -10),
                           xycoords='axes fraction',
                           textcoords='offset pixels',
                           va='top', ha='left')
+    e_label = ax_r.annotate('all channels', (0, 1), (10, -10),
+                            xycoords='axes fraction',
+                            textcoords='offset pixels',
+                            va='top', ha='left')
+
+    # while dragging, the marginal being changed is animated and only it
+    # is redrawn, on release it goes back to a normal artist
+    changing = {ax_t: (p_line, label), ax_r: (e_line, e_label)}
+    backgrounds = {}
+
+    def start_drag(a):
+        if a in backgrounds:
+            return
+        for art in changing[a]:
+            art.set_animated(True)
+        # render only this axes without them (not the whole figure) on a
+        # blank canvas, then put back what the last draw left there
+        canvas = fig.canvas
+        renderer = canvas.get_renderer()
+        whole = canvas.copy_from_bbox(fig.bbox)
+        renderer.clear()
+        fig.patch.draw(renderer)
+        a.draw(renderer)
+        backgrounds[a] = canvas.copy_from_bbox(a.bbox)
+        canvas.restore_region(whole)
+
+    def end_drag(a):
+        backgrounds.pop(a, None)
+        for art in changing[a]:
+            art.set_animated(False)
+
+    def on_draw(event):
+        for a in backgrounds:
+            backgrounds[a] = fig.canvas.copy_from_bbox(a.bbox)
+            for art in changing[a]:
+                a.draw_artist(art)
+
+    def blit(a):
+        if not getattr(fig.canvas, 'supports_blit', True):
+            # same as SpanSelector does with useblit on these canvases
+            fig.canvas.draw_idle()
+            return
+        start_drag(a)
+        fig.canvas.restore_region(backgrounds[a])
+        # includes the span of the other selector
+        for art in a.get_children():
+            if art.get_animated() and art.get_visible():
+                a.draw_artist(art)
+        fig.canvas.blit(a.bbox)
+
+    draw_cid = fig.canvas.mpl_connect('draw_event', on_draw)
+
+    # the stored tables are read until the figure goes away
+    if summary['file'] is not None:
+        fig.canvas.mpl_connect('close_event',
+                               lambda event: summary['file'].close())
+
+    def set_energy_band(lo, hi):
+        p_line.set_ydata(integrate_band(cumulative, bins, lo, hi))
+        label.set_text(f'[{lo:.1f}, {hi:.1f}] keV')
+
+    def set_channel_band(lo, hi):
+        e_line.set_xdata(integrate_band(channel_cumulative, channel_bins,
+                                        lo, hi))
+        e_label.set_text(f'channels [{lo:.0f}, {hi:.0f}]')
+
+    # keep the limits while dragging, rescale once released
+    def drag_energy(lo, hi):
+        set_energy_band(lo, hi)
+        blit(ax_t)
 
     def update(lo, hi):
-        p_data = integrate_to_angles(spectrum, bins, lo, hi)
-        p_line.set_ydata(p_data)
+        end_drag(ax_t)
+        set_energy_band(lo, hi)
         ax_t.relim()
         ax_t.autoscale(axis='y')
+        fig.canvas.draw_idle()
 
-        label.set_text(f'[{lo:.1f}, {hi:.1f}] keV')
+    def drag_channels(lo, hi):
+        set_channel_band(lo, hi)
+        blit(ax_r)
+
+    def update_channels(lo, hi):
+        end_drag(ax_r)
+        set_channel_band(lo, hi)
+        ax_r.relim()
+        ax_r.autoscale(axis='x')
+        ax_r.set_xlim(xmin=0)
         fig.canvas.draw_idle()
 
     span = SpanSelector(ax_r, update, 'vertical', useblit=True,
                         rectprops={'alpha': .5, 'facecolor': 'red'},
-                        span_stays=True)
+                        span_stays=True, onmove_callback=drag_energy)
+    channel_span = SpanSelector(ax_t, update_channels, 'horizontal',
+                                useblit=True,
+                                rectprops={'alpha': .5, 'facecolor': 'red'},
+                                span_stays=True,
+                                onmove_callback=drag_channels)
 
     ax.set_xlabel('channel [#]')
     ax.set_ylabel('E [keV]')
@@ -63,19 +638,22 @@ def plot_all_chan_spectrum(spectrum, bins, *, ax=None, **kwargs):
     ax.set_ylim(bins[0], bins[-1])
     ax_r.set_xlim(xmin=0)
 
-    return spectrum, bins, {'center': {'ax': ax, 'im': im},
-                            'top': {'ax': ax_t, 'p_line': p_line},
+    return spectrum, bins, {'center': {'ax': ax, 'im': pyramid.im,
+                                       'pyramid': pyramid},
+                            'top': {'ax': ax_t, 'p_line': p_line,
+                                    'span': channel_span},
                             'right': {'ax': ax_r, 'e_line': e_line,
-                                      'span': span}}
+                                      'span': span},
+                            'draw_cid': draw_cid}
 
 
-with h5py.File('germ.h5', 'r') as fin:
-    spectrum = fin['spectrum'][:]
-    bins = fin['bins'][:]
+# leave the spectrum on disk, it is read as needed
+fin = h5py.File('germ.h5', 'r')
+spectrum = fin['spectrum']
+bins = fin['bins'][:]
 
 ret = plot_all_chan_spectrum(spectrum, bins)
 plt.show()
 
-
-# Exercise (15 minutes)
-# - add span selector to top axes to change curve in right axes
+# for row in benchmark_band_update(spectrum, bins):
+#     print(row)
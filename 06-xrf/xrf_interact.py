@@ -13,9 +13,136 @@ import numpy as np
 import matplotlib.pyplot as plt
 
 
+class CumulativeCube(object):
+    def __init__(self, counts, dtype=np.float64, memory_budget=None,
+                 filename=None, chunk_bytes=2**26):
+        '''Running totals of an XRF cube along the channels
+
+        Entry ``k`` of the table is the map of the counts in the channels
+        below ``k * bin_width``, so the map of any window of channels is
+        the difference of two entries.  The table is stored channel-major
+        so each entry is one contiguous image.
+
+        Parameters
+        ----------
+        counts : array
+            (ny, nx, nchan) counts
+
+        dtype : dtype, optional
+            float64 or float32.  Totals are accumulated in float64
+            either way, but float32 storage loses precision for narrow
+            windows at high channel numbers.
+
+        memory_budget : int, optional
+            Maximum size of the table in bytes.  If the table for every
+            channel would be larger, channels are summed into bins so it
+            fits, and windows are rounded to the bin edges.
+
+        filename : str, optional
+            If given the table is a memory-mapped ``.npy`` file
+
+        chunk_bytes : int, optional
+            How much of the cube to work on at once while building
+        '''
+        ny, nx, n_chan = counts.shape
+        dtype = np.dtype(dtype)
+        image_bytes = ny * nx * dtype.itemsize
+        bin_width = 1
+        if memory_budget is not None:
+            n_entries = memory_budget // image_bytes
+            if n_entries < 2:
+                raise ValueError('memory_budget can not hold even 2 '
+                                 'images of {} bytes'.format(image_bytes))
+            bin_width = -(-n_chan // (n_entries - 1))
+        n_bins = -(-n_chan // bin_width)
+        shape = (n_bins + 1, ny, nx)
+        if filename is None:
+            table = np.empty(shape, dtype=dtype)
+        else:
+            table = np.lib.format.open_memmap(filename, mode='w+',
+                                              dtype=dtype, shape=shape)
+        table[0] = 0
+        carry = np.zeros((ny, nx), dtype=np.float64)
+        step = max(chunk_bytes // (ny * nx * 8 * bin_width), 1)
+        for k0 in range(0, n_bins, step):
+            k1 = min(k0 + step, n_bins)
+            block = np.asarray(counts[:, :, k0 * bin_width:k1 * bin_width],
+                               dtype=np.float64)
+            if bin_width > 1:
+                # pad the last bin out to a whole bin_width
+                pad = (k1 - k0) * bin_width - block.shape[2]
+                if pad:
+                    block = np.concatenate(
+                        [block, np.zeros((ny, nx, pad))], axis=2)
+                block = block.reshape(ny, nx, k1 - k0, bin_width).sum(axis=3)
+            totals = np.cumsum(block, axis=2)
+            totals += carry[:, :, np.newaxis]
+            table[k0 + 1:k1 + 1] = np.moveaxis(totals, 2, 0)
+            carry = totals[:, :, -1]
+        if filename is not None:
+            table.flush()
+        self.table = table
+        self.bin_width = bin_width
+        self.n_chan = n_chan
+
+    @property
+    def nbytes(self):
+        return self.table.nbytes
+
+    def window(self, lo, hi):
+        '''Map of the counts in channels ``lo <= c < hi``
+
+        Returns
+        -------
+        image : array
+            (ny, nx) float64
+
+        channels : tuple
+            The window actually used, which is rounded to the bin edges
+        '''
+        n_bins = len(self.table) - 1
+        lo_k, hi_k = (int(np.clip(round(v / self.bin_width), 0, n_bins))
+                      for v in (lo, hi))
+        if hi > lo and hi_k <= lo_k:
+            # narrower than a bin, show the bin
+            hi_k = min(lo_k + 1, n_bins)
+            lo_k = hi_k - 1
+        image = (self.table[hi_k].astype(np.float64) -
+                 self.table[lo_k].astype(np.float64))
+        return image, (lo_k * self.bin_width,
+                       min(hi_k * self.bin_width, self.n_chan))
+
+
 class XRFInteract(object):
     def __init__(self, counts, positions, fig=None, pos_order=None,
-                 norm=None):
+                 norm=None, cumulative=False, cumulative_kw=None):
+        '''Explore an XRF map and its spectra
+
+        Parameters
+        ----------
+        counts : array
+            (ny, nx, nchan) counts
+
+        positions : array
+            (2, ny, nx) positions of the pixels
+
+        fig : Figure, optional
+
+        pos_order : dict, optional
+            Which of `positions` is 'x' and 'y'
+
+        norm : array, optional
+            (ny, nx) normalization of each pixel
+
+        cumulative : bool, optional
+            If True, pre-compute a `CumulativeCube` so the map of a
+            channel window is two slices and a subtraction rather than a
+            sum over the window
+
+        cumulative_kw : dict, optional
+            Passed to `CumulativeCube`, for example to set `dtype`,
+            `memory_budget` or `filename`
+        '''
 
         if pos_order is None:
             pos_order = {'x': 0,
@@ -30,6 +157,10 @@ class XRFInteract(object):
 
         norm = np.atleast_3d(norm[:])
         self.counts = counts[:] / norm
+        self.cumulative = None
+        if cumulative:
+            self.cumulative = CumulativeCube(self.counts,
+                                             **(cumulative_kw or {}))
 
         # compute values we will use for extents below
         dx = np.diff(xpos.mean(axis=0)).mean()
@@ -173,7 +304,10 @@ class XRFInteract(object):
 
     def _on_span(self, vmin, vmax):
         vmin, vmax = map(int, (vmin, vmax))
-        new_image = self.counts[:, :, vmin:vmax].sum(axis=2)
+        if self.cumulative is not None:
+            new_image, (vmin, vmax) = self.cumulative.window(vmin, vmax)
+        else:
+            new_image = self.counts[:, :, vmin:vmax].sum(axis=2)
         new_max = new_image.max()
         self._EROI_txt.set_text('ROI: {}:{}'.format(vmin, vmax))
         self.im.set_data(new_image)
@@ -237,6 +371,12 @@ g = F['xrfmap']
 
 xrf = XRFInteract(g['detsum']['counts'][:], g['positions']['pos'][:],
                   norm=g['scalers']['val'][:, :, 0])
+# for large maps, make energy windows cheap (at the cost of a table the
+# size of the data, or a coarser one within a budget)
+# xrf = XRFInteract(g['detsum']['counts'][:], g['positions']['pos'][:],
+#                   norm=g['scalers']['val'][:, :, 0], cumulative=True,
+#                   cumulative_kw={'dtype': 'float32',
+#                                  'memory_budget': 2**30})
 
 # un comment out this line to use 'interacitve' mode
 # plt.ion()